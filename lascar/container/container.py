@@ -242,6 +242,11 @@ class Container:
     def apply_leakage_processing(self, leakages):
         if self.leakage_processing is None:
             return leakages
+        if (
+            hasattr(self.leakage_processing, "process_batch")
+            and leakages.ndim == len(self._leakage_section_abstract.shape) + 1
+        ):  # processing of a whole batch at once
+            return self.leakage_processing.process_batch(leakages)
         if self._leakage_section_abstract.shape == ():  # 0D leakage
             return np.array([self.leakage_processing(l) for l in leakages])
         return np.apply_along_axis(self.leakage_processing, 1, leakages)
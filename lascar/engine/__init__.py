@@ -27,13 +27,21 @@ from .guess_engine import GuessEngine
 from .partitioner_engine import PartitionerEngine
 from .cpa_engine import CpaEngine
 from .cpa_engine import CpaPartitionedEngine
+from .cpa_engine import ModelBankCpaEngine
+from .cpa_engine import SecondOrderCpaEngine
 from .dpa_engine import DpaEngine
 from .nicv_engine import NicvEngine
+from .nicv_engine import MultiTargetNicvEngine
 from .snr_engine import SnrEngine
+from .snr_engine import MultiTargetSnrEngine
 from .ttest_engine import TTestEngine
+from .ttest_engine import BivariateTTestEngine
 from .chi2test_engine import Chi2TestEngine
+from .covariance_engine import CovarianceEngine
 from .ttest_engine import compute_ttest
 from .lra_engine import LraEngine
+from .mia_engine import MiaEngine
+from .quantile_engine import QuantileEngine
 
 from .classifier_engine import MatchEngine
 from .classifier_engine import ProfileEngine
@@ -42,5 +50,10 @@ from .classifier_engine import load_classifier
 
 from .dom_engine import DomEngine
 
-# from .template_engine import TemplateProfileEngine
-# from .template_engine import TemplateMatchEngine
+from .bootstrap_engine import BootstrapEngine
+from .sharded_engine import ShardedGuessEngine
+from .success_rate_engine import SuccessRateEngine
+
+from .template_engine import GaussianTemplates
+from .template_engine import TemplateProfileEngine
+from .template_engine import TemplateMatchEngine
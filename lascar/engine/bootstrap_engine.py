@@ -0,0 +1,175 @@
+# This file is part of lascar
+#
+# lascar is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+#
+#
+# Copyright 2018 Manuel San Pedro, Victor Servant, Charles Guillemet, Ledger SAS - manuel.sanpedro@ledger.fr, victor.servant@ledger.fr, charles@ledger.fr
+
+"""
+bootstrap_engine.py
+"""
+import copy
+
+import numpy as np
+
+from . import CpaPartitionedEngine
+from . import Engine
+from . import LraEngine
+from . import NicvEngine
+from . import PartitionerEngine
+from . import SnrEngine
+from .engine import _EngineSession
+from .engine import _StackedMeanVar
+from .engine import stack_accumulators
+from lascar.container import TraceBatchContainer
+
+# the engines whose whole state is held in _acc_x_by_partition and _partition_count
+_VECTORIZABLE_ENGINES = (SnrEngine, NicvEngine, CpaPartitionedEngine, LraEngine)
+
+
+class BootstrapEngine(Engine):
+    """
+    BootstrapEngine wraps an engine, and computes bootstrap confidence intervals of its results,
+    in one single pass over the traces.
+
+    It uses the online (Poisson) bootstrap: the engine is replicated number_of_replicates times, and for each replicate,
+    each trace is given a Poisson(1) weight (the number of times it is drawn in the resampled set of traces).
+    The wrapped engine itself processes the traces normally.
+
+    For the PartitionerEngines whose whole state is held in their partition accumulators (SnrEngine, NicvEngine,
+    CpaPartitionedEngine, LraEngine), when they keep the default update, the accumulators of all the replicates are
+    updated at once, with one weighted matrix product per partition.
+    Any other engine (eg TTestEngine) is updated once per replicate, with a batch where each trace is repeated
+    according to its weight.
+
+    The finalize() method outputs a np.array of shape (3,) + results shape, containing:
+    the results of the wrapped engine, the lower and the upper bounds of the (percentile) confidence intervals.
+    The results of the replicates are kept in replicates_results.
+    """
+
+    def __init__(
+        self, engine, number_of_replicates=100, confidence=0.95, name=None, random_state=None, vectorized=True
+    ):
+        """
+
+        :param engine: the engine to be bootstrapped (not registered to the Session)
+        :param number_of_replicates: number of bootstrap replicates
+        :param confidence: the confidence level of the intervals
+        :param name:
+        :param random_state: seed (or np.random.Generator) used to draw the weights
+        :param vectorized: if False, the replicates are always updated on resampled batches
+        """
+        if name is None:
+            name = "bootstrap_%s" % engine.name
+        Engine.__init__(self, name)
+        self.engine = engine
+        self.number_of_replicates = number_of_replicates
+        self.confidence = confidence
+        self._random_state = random_state
+        self._vectorized = (
+            vectorized
+            and isinstance(engine, _VECTORIZABLE_ENGINES)
+            and type(engine).update is Engine.update
+            and type(engine)._update is PartitionerEngine._update
+        )
+        self.replicates_results = None
+        self.logger.debug(
+            'Creating BootstrapEngine "%s" with %d replicates.' % (name, number_of_replicates)
+        )
+
+    def _initialize(self):
+        self._rng = np.random.default_rng(self._random_state)
+
+        self._replicates = []
+        for _ in range(self.number_of_replicates):
+            replicate = copy.copy(self.engine)
+            replicate.result = {}
+            replicate.finalize_step = []
+            replicate.size_in_memory = 0
+            replicate.initialize(_EngineSession(self._session))
+            self._replicates.append(replicate)
+        self.engine.initialize(self._session)
+
+        if self._vectorized:
+            # the accumulators of the replicates become views on stacked accumulators,
+            # spilled in the spill_directory of the wrapped engine, if any
+            self._spill_directory = self.engine._spill_directory
+            self._acc_x_by_partition = stack_accumulators(
+                self._replicates, "_acc_x_by_partition", allocate=self._allocate_accumulator
+            )
+            for replicate in self._replicates:
+                replicate._remove_spilled_accumulators()
+            self._partition_count = stack_accumulators(self._replicates, "_partition_count")
+            self._mean_var = _StackedMeanVar([replicate._session for replicate in self._replicates])
+
+        self.size_in_memory = self.engine.size_in_memory * (self.number_of_replicates + 1)
+
+    def _update(self, batch):
+        self.engine.update(batch)
+
+        weights = self._rng.poisson(1.0, (self.number_of_replicates, len(batch)))
+        if self._vectorized:
+            self._update_vectorized(batch, weights)
+        else:
+            for replicate, w in zip(self._replicates, weights):
+                indexes = np.repeat(np.arange(len(batch)), w)
+                if not len(indexes):
+                    continue
+                resampled = TraceBatchContainer(batch.leakages[indexes], batch.values[indexes])
+                replicate._session["mean"].update(resampled)
+                replicate._session["var"].update(resampled)
+                replicate.update(resampled)
+
+    def _update_vectorized(self, batch, weights):
+        leakages = batch.leakages.reshape((len(batch), -1)).astype(np.double)
+        weights = weights.astype(np.double)
+
+        self._mean_var.update(leakages, weights)
+        for replicate, number_of_traces in zip(self._replicates, weights.sum(1)):
+            replicate._add_processed_traces(number_of_traces)
+
+        # acc[replicate, order, partition, sample] += sum(weights * leakages ** order | partition)
+        acc = self._acc_x_by_partition.reshape(
+            self._acc_x_by_partition.shape[:3] + (-1,)
+        )
+        partition_indexes = self.engine.get_partition_indexes(batch.values)
+        for p in np.unique(partition_indexes):
+            mask = partition_indexes == p
+            w, x = weights[:, mask], leakages[mask]
+            self._partition_count[:, p] += w.sum(1)
+            power = x
+            for o in range(acc.shape[1]):
+                if o:
+                    power = power * x
+                acc[:, o, p] += w @ power
+
+    def _finalize(self):
+        results = np.asarray(self.engine.finalize())
+        self.replicates_results = np.array([replicate.finalize() for replicate in self._replicates])
+
+        alpha = (1 - self.confidence) / 2
+        lower, upper = np.nanpercentile(self.replicates_results, [100 * alpha, 100 * (1 - alpha)], axis=0)
+        return np.array([results, lower, upper])
+
+    def _clean(self):
+        self.engine.clean()
+        for replicate in self._replicates:
+            replicate.clean()
+        del self._replicates
+        if self._vectorized:
+            del self._acc_x_by_partition
+            del self._partition_count
+            del self._mean_var
+            self._remove_spilled_accumulators()
+        self.size_in_memory = 0
@@ -19,8 +19,7 @@
 import numpy as np
 
 from . import PartitionerEngine
-from bisect import bisect
-from scipy.stats import chi2_contingency
+from scipy.stats import chi2
 
 
 class Chi2TestEngine(PartitionerEngine):
@@ -34,58 +33,136 @@ class Chi2TestEngine(PartitionerEngine):
     It needs as en input a partition_function that will take trace values as an input and returns 0 or 1
     (2 partitions_values).
 
+    The (partition, sample, bin) histogram can be stored on disk (spill_directory), as a memmap. It is updated and
+    finalized by blocks of samples, whose temporaries fit in block_memory bytes.
     """
 
-    def __init__(self, name, partition_function, n_bins, bin_range):
+    def __init__(self, name, partition_function, n_bins, bin_range, jit=True, spill_directory=None, block_memory=2 ** 24):
         """
 
         :param name:
         :param partition_function: partition_function that will take trace values as an input and returns 0 or 1
         :param n_bins: number of bins for the histogram
-        :param bin_range: (min, max) lower and upper bounds for the bins
+        :param bin_range: (min, max) lower and upper bounds for the bins. Samples outside are counted in the edge bins.
+        :param spill_directory: if set, the histogram is stored as a memmap in this directory
+        :param block_memory: maximum size (in bytes) of the temporaries used for a block of samples
         """
-        PartitionerEngine.__init__(self, name, partition_function, range(2), 2)
+        PartitionerEngine.__init__(
+            self, partition_function, range(2), 1, name=name, jit=jit, spill_directory=spill_directory
+        )
+        self._block_memory = block_memory
         self.logger.debug('Creating Chi2TestEngine  "%s". ' % (name))
 
         bin_width = (bin_range[1]-bin_range[0])/n_bins
-        self._bin_starts = [bin_range[0]+i*bin_width for i in range(n_bins)]
-
+        self._bin_starts = np.array([bin_range[0]+i*bin_width for i in range(n_bins)], dtype=np.double)
 
     def _initialize(self):
-        PartitionerEngine._initialize(self)
-        self._histogram = np.zeros((self._partition_size,)+self._session.leakage_shape+(len(self._bin_starts),), dtype=np.dtype("uint32"))
-
-    def update(self, batch):
-        partition_values = list(map(self._partition_function, batch.values))
-        for i, v in enumerate(partition_values):
-            idx_part = self._partition_range_to_index[v]
-            self._partition_count[idx_part] += 1
-            # Increment the right bin for every sample in the trace
-            for idx_sample in np.ndindex(self._session.leakage_shape):
-                x = batch.leakages[i,idx_sample]
-                # Use dichotomy to find bin index
-                idx_bin = bisect(self._bin_starts, x) - 1
-                self._histogram[idx_part,idx_sample,idx_bin] += 1
+        self._partition_count = np.zeros((self._partition_size,), dtype=np.double)
+        self._histogram = self._allocate_accumulator(
+            (self._partition_size,) + self._session.leakage_shape + (len(self._bin_starts),), np.dtype("uint32")
+        )
+        self.size_in_memory += self._partition_count.nbytes
+
+    def _get_sample_blocks(self, bytes_per_sample):
+        number_of_samples = int(np.prod(self._session.leakage_shape))
+        block_size = max(1, int(self._block_memory // bytes_per_sample))
+        return [
+            slice(start, min(start + block_size, number_of_samples))
+            for start in range(0, number_of_samples, block_size)
+        ]
+
+    def _update(self, batch):
+        partition_indexes = self.get_partition_indexes(batch.values)
+        self._partition_count += np.bincount(partition_indexes, minlength=self._partition_size)
+
+        bin_indexes = get_bin_indexes(self._bin_starts, batch.leakages.reshape((len(batch), -1)))
+        histogram = self._histogram.reshape((self._partition_size, -1, len(self._bin_starts)))
+        # the bincount temporary is of size (partition, block, bin)
+        for block in self._get_sample_blocks(8 * (len(batch) + self._partition_size * len(self._bin_starts))):
+            accumulate_histogram(histogram[:, block], partition_indexes, bin_indexes[:, block])
 
     def _finalize(self):
         # P stores the final p-value for each point in time
-        P = np.zeros(self._session.leakage_shape)
-        for idx_sample in np.ndindex(self._session.leakage_shape):
-            # Filter out zero columns for a given point in time
-            condition = [not all([self._histogram[idx_part][idx_sample][k] == 0 for idx_part in range(self._partition_size)]) for k in range(len(self._bin_starts))] 
-            # Build contingency tables at each point in time
-            tables = np.zeros((self._partition_size, condition.count(True)))
-            for idx_part in range(self._partition_size):
-                tables[idx_part] = self._histogram[idx_part][idx_sample][condition]
-    
-            _, p, _, _ = chi2_contingency(tables)
-            if p == 0:
-                p = np.finfo(float).tiny
-            P[idx_sample] = p
-
-        return P
+        histogram = self._histogram.reshape((self._partition_size, -1, len(self._bin_starts)))
+        P = np.zeros((histogram.shape[1],), np.double)
+        for block in self._get_sample_blocks(8 * 8 * self._partition_size * len(self._bin_starts)):
+            _, P[block] = chi2_contingency_by_sample(histogram[:, block])
+        P[P == 0] = np.finfo(float).tiny
+        return P.reshape(self._session.leakage_shape)
 
     def _clean(self):
         del self._histogram
-        del self._bin_starts
-        PartitionerEngine._clean(self)
+        del self._partition_count
+        self._remove_spilled_accumulators()
+        self.size_in_memory = 0
+
+
+def get_bin_indexes(bin_starts, leakages):
+    """
+    Compute the histogram bin index of each sample of a batch of leakages.
+
+    Bins are given by their lower bounds, sorted. Samples below the first bin (resp. above the last one) are
+    assigned to the first (resp. last) bin.
+
+    :param bin_starts: np.array of the lower bounds of the bins
+    :param leakages: np.array of leakages
+    :return: np.array of bin indexes, with the same shape as leakages
+    """
+    idx = np.searchsorted(bin_starts, leakages, side="right") - 1
+    return np.clip(idx, 0, len(bin_starts) - 1)
+
+
+def accumulate_histogram(histogram, class_indexes, bin_indexes):
+    """
+    Accumulate a batch into a (classes, samples, bins) histogram, with a single flat-index bincount.
+
+    :param histogram: np.array of shape (classes, samples, bins), updated in place
+    :param class_indexes: np.array of shape (batch,): class index of each trace
+    :param bin_indexes: np.array of shape (batch, samples): bin index of each sample of each trace
+    """
+    _, number_of_samples, number_of_bins = histogram.shape
+    flat_indexes = (
+        class_indexes.astype(np.intp)[:, None] * number_of_samples
+        + np.arange(number_of_samples, dtype=np.intp)[None, :]
+    ) * number_of_bins + bin_indexes
+    histogram += np.bincount(
+        flat_indexes.reshape(-1), minlength=histogram.size
+    ).reshape(histogram.shape).astype(histogram.dtype)
+
+
+def chi2_contingency_by_sample(histogram):
+    """
+    Pearson's chi square test of independence, computed for all the samples at once.
+
+    For each sample, the contingency table is histogram[:, sample, :], from which the all-zero columns (bins) are
+    filtered out. Results match scipy.stats.chi2_contingency (including Yates' correction when the degree of
+    freedom is 1) applied sample by sample.
+
+    :param histogram: np.array of shape (classes, samples, bins)
+    :return: (chi2 statistics, p-values), both of shape (samples,)
+    """
+    observed = histogram.astype(np.double)
+    row_sums = observed.sum(2, keepdims=True)
+    col_sums = observed.sum(0, keepdims=True)
+    total = col_sums.sum(2, keepdims=True)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        expected = row_sums * col_sums / total
+
+    # zero columns are filtered out: they are neither counted in the dof nor in the statistic
+    non_zero_columns = col_sums[0] > 0
+    number_of_columns = non_zero_columns.sum(1)
+    number_of_rows = observed.shape[0]
+    dof = (number_of_rows - 1) * (number_of_columns - 1)
+
+    # Yates' correction for continuity when dof == 1
+    yates = (dof == 1)[None, :, None]
+    diff = expected - observed
+    observed = np.where(yates, observed + np.sign(diff) * np.minimum(0.5, np.abs(diff)), observed)
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        terms = (observed - expected) ** 2 / expected
+    statistics = np.where(non_zero_columns[None], terms, 0.0).sum((0, 2))
+
+    statistics[dof == 0] = 0.0
+    p_values = np.where(dof == 0, 1.0, chi2.sf(statistics, np.maximum(dof, 1)))
+    return statistics, p_values
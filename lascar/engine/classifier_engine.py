@@ -35,6 +35,16 @@ class ProfileEngine(PartitionerEngine):
     After the partition is done, the finalize() method output the classifier updated.
     It can hence be used by MatchEngine.
 
+    By default, the classifier is trained once, on a single batch containing the whole container.
+    With streaming=True, the classifier is trained incrementally along the batches delivered by the Session,
+    so that the profiling set does not have to fit in memory:
+
+        - sklearn classifiers must implement partial_fit(), which is called on each batch.
+        - keras models are trained with train_on_batch() on mini-batches drawn from a shuffle buffer of
+          shuffle_buffer_size traces. The validation traces are held out by index (a fraction test_size of the
+          container, drawn at random) and evaluated on the fly. Each Session run is one epoch: run the Session
+          several times to train for several epochs.
+
     see examples/attacks/classifier.py for an example.
 
     """
@@ -48,7 +58,10 @@ class ProfileEngine(PartitionerEngine):
         test_size=0.1,
         verbose=1,
         batch_size=128,
-        name=None
+        name=None,
+        streaming=False,
+        shuffle_buffer_size=10000,
+        random_state=None,
     ):
         """
 
@@ -60,23 +73,32 @@ class ProfileEngine(PartitionerEngine):
         :param test_size: only used when using keras model, will be passed to the keras .fit() method
         :param verbose: only used when using keras model, will be passed to the keras .fit() method
         :param batch_size: only used when using keras model, will be passed to the keras .fit() method
+        :param streaming: if True, the classifier is trained incrementally along the batches
+        :param shuffle_buffer_size: only used when streaming with a keras model: number of traces of the shuffle buffer
+        :param random_state: only used when streaming with a keras model: seed for the shuffling and the validation split
         """
 
-        import tensorflow.keras as keras
         import sklearn
 
-        if not isinstance(classifier, sklearn.base.ClassifierMixin) and not (
-            isinstance(classifier, keras.Model) and classifier._is_compiled
-        ):
+        if isinstance(classifier, sklearn.base.ClassifierMixin):
+            classifier_type = "sklearn"
+        else:
+            import tensorflow.keras as keras
+
+            if not (isinstance(classifier, keras.Model) and classifier._is_compiled):
+                raise ValueError(
+                    "Classifier should be a sklearn classifier or a compiled keras model."
+                )
+            classifier_type = "keras"
+
+        if streaming and classifier_type == "sklearn" and not hasattr(classifier, "partial_fit"):
             raise ValueError(
-                "Classifier should be a sklearn classifier or a compiled keras model."
+                "Streaming mode needs a sklearn classifier implementing partial_fit()."
             )
 
         PartitionerEngine.__init__(self, partition_function, partition_range, 1, name=name)
         self._classifier = classifier
-        self.classifier_type = (
-            "keras" if isinstance(classifier, keras.Model) else "sklearn"
-        )
+        self.classifier_type = classifier_type
 
         self.output_parser_mode = None
 
@@ -86,33 +108,64 @@ class ProfileEngine(PartitionerEngine):
         self.verbose = verbose
         self.batch_size = batch_size
 
+        self.streaming = streaming
+        self.shuffle_buffer_size = shuffle_buffer_size
+        self.random_state = random_state
+        self._validation_mask = None
+
     def _initialize(self):
 
-        self._session._batch_size = self._session.container.number_of_traces
+        if not self.streaming:
+            self._session._batch_size = self._session.container.number_of_traces
         self._session._thread_on_update = False
         if self.classifier_type == "keras":
             self._session._progressbar = None
 
         self._partition_count = np.zeros((self._partition_size,), dtype=np.double)
 
+        if self.streaming and self.classifier_type == "keras":
+            self._get_validation_mask(self._session.container.number_of_traces)
+            self._buffer_leakages = None
+            self._buffer_labels = np.zeros((self.shuffle_buffer_size,), dtype=np.intp)
+            self._buffer_count = 0
+            self._validation_loss, self._validation_count = 0.0, 0
+
+    def _get_validation_mask(self, number_of_traces):
+        """
+        The traces held out for validation (streaming keras models).
+        The mask is drawn once (and the history is started), so that the same traces are held out at every epoch,
+        ie every Session run on the same container. It is drawn again only if the number of traces changes.
+        """
+        if self._validation_mask is None or len(self._validation_mask) != number_of_traces:
+            self._rng = np.random.default_rng(self.random_state)
+            self._validation_mask = self._rng.random(number_of_traces) < self.test_size
+            self.history = {"loss": [], "val_loss": []}
+        return self._validation_mask
+
     def _update(self, batch):
+        partition_indexes = self.get_partition_indexes(batch.values)
+        self._partition_count += np.bincount(partition_indexes, minlength=self._partition_size)
+
         if self.classifier_type == "sklearn":
-            self._update_sklearn_classifier(batch)
+            self._update_sklearn_classifier(batch, partition_indexes)
+        elif self.streaming:
+            self._update_keras_model_streaming(batch, partition_indexes)
         else:
-            self._update_keras_model(batch)
+            self._update_keras_model(batch, partition_indexes)
 
-    def _update_sklearn_classifier(self, batch):
-        partition_values = list(map(self._partition_function, batch.values))
-        for v in partition_values:
-            self._partition_count[self._partition_range_to_index[v]] += 1
-        self._classifier.fit(batch.leakages, partition_values)
+    def _update_sklearn_classifier(self, batch, partition_indexes):
+        partition_values = self._partition_range[partition_indexes]
+        if self.streaming:
+            self._classifier.partial_fit(
+                batch.leakages, partition_values, classes=self._partition_range
+            )
+        else:
+            self._classifier.fit(batch.leakages, partition_values)
 
-    def _update_keras_model(self, batch):
+    def _update_keras_model(self, batch, partition_indexes):
         from tensorflow.keras.utils import to_categorical
 
-        Y = to_categorical(
-            list(map(self._partition_function, batch.values)), self._partition_size
-        )
+        Y = to_categorical(partition_indexes, self._partition_size)
         X_train, X_test, Y_train, Y_test = train_test_split(
             batch.leakages, Y, test_size=self.test_size
         )
@@ -129,7 +182,63 @@ class ProfileEngine(PartitionerEngine):
         self.score_train = self._classifier.evaluate(X_train, Y_train)
         self.score_test = self._classifier.evaluate(X_test, Y_test)
 
+    def _update_keras_model_streaming(self, batch, partition_indexes):
+        from tensorflow.keras.utils import to_categorical
+
+        # the offset of the batch is the number of traces already processed
+        offset = self._number_of_processed_traces
+        validation = self._validation_mask[offset : offset + len(batch)]
+
+        if validation.any():
+            loss = self._classifier.test_on_batch(
+                batch.leakages[validation],
+                to_categorical(partition_indexes[validation], self._partition_size),
+            )
+            loss = loss[0] if isinstance(loss, (list, tuple)) else loss
+            self._validation_loss += loss * validation.sum()
+            self._validation_count += validation.sum()
+
+        train = np.where(~validation)[0]
+        if self._buffer_leakages is None:
+            self._buffer_leakages = np.zeros(
+                (self.shuffle_buffer_size,) + batch.leakages.shape[1:], batch.leakages.dtype
+            )
+
+        while len(train):
+            n = min(len(train), self.shuffle_buffer_size - self._buffer_count)
+            self._buffer_leakages[self._buffer_count : self._buffer_count + n] = batch.leakages[train[:n]]
+            self._buffer_labels[self._buffer_count : self._buffer_count + n] = partition_indexes[train[:n]]
+            self._buffer_count += n
+            train = train[n:]
+            if self._buffer_count == self.shuffle_buffer_size:
+                self._train_on_buffer()
+
+    def _train_on_buffer(self):
+        """
+        Shuffle the buffer, and train the keras model with mini-batches of batch_size traces drawn from it.
+        """
+        from tensorflow.keras.utils import to_categorical
+
+        permutation = self._rng.permutation(self._buffer_count)
+        for i in range(0, self._buffer_count, self.batch_size):
+            idx = permutation[i : i + self.batch_size]
+            loss = self._classifier.train_on_batch(
+                self._buffer_leakages[idx],
+                to_categorical(self._buffer_labels[idx], self._partition_size),
+            )
+            self.history["loss"].append(loss[0] if isinstance(loss, (list, tuple)) else loss)
+        self._buffer_count = 0
+
     def _finalize(self):
+        if self.streaming and self.classifier_type == "keras":
+            # intermediate output steps leave the shuffle buffer and the validation loss of the epoch untouched
+            if self._number_of_processed_traces < len(self._validation_mask):
+                return self._classifier
+            if self._buffer_count:
+                self._train_on_buffer()
+            if self._validation_count:
+                self.history["val_loss"].append(self._validation_loss / self._validation_count)
+                self._validation_loss, self._validation_count = 0.0, 0
         return self._classifier
 
 
@@ -143,7 +252,14 @@ class MatchEngine(GuessEngine):
     """
 
     def __init__(
-        self, classifier, selection_function, guess_range, name=None, solution=None
+        self,
+        classifier,
+        selection_function,
+        guess_range,
+        name=None,
+        solution=None,
+        jit=True,
+        prediction_batch_size=None,
     ):
         """
 
@@ -152,43 +268,51 @@ class MatchEngine(GuessEngine):
         :param selection_function:
         :param guess_range:
         :param solution:
+        :param jit: jit the selection_function (see GuessEngine)
+        :param prediction_batch_size: if set, the classifier predictions are computed by chunks of this size
         """
         if name is None:
             name = "match_engine"
-        GuessEngine.__init__(self, selection_function, guess_range, name=name, solution=solution)
+        GuessEngine.__init__(self, selection_function, guess_range, name=name, solution=solution, jit=jit)
         self._classifier = classifier
+        self.prediction_batch_size = prediction_batch_size
         self.output_parser_mode = "max"
 
     def _initialize(self):
         self._log_probas = np.zeros((self._number_of_guesses,))
-        self._session._batch_size = self._session.container.number_of_traces
         self._session._thread_on_update = False
 
-    def _update(self, batch):
-
-        y = np.array(
-            [
-                [self._function(d, guess) for guess in self._guess_range]
-                for d in batch.values
-            ]
-        )
-
+    def _predict_log_probas(self, leakages):
         if hasattr(self._classifier, "predict_log_proba"):
-            log_probas = self._classifier.predict_log_proba(batch.leakages)
+            return self._classifier.predict_log_proba(leakages)
         elif hasattr(self._classifier, "predict_proba"):
-            log_probas = np.log2(self._classifier.predict_proba(batch.leakages))
+            return np.log2(self._classifier.predict_proba(leakages))
         elif hasattr(self._classifier, "predict"):
-            log_probas = np.log2(self._classifier.predict(batch.leakages))
+            return np.log2(self._classifier.predict(leakages))
         else:
             raise ValueError(
                 "the classifier should have either .predict_proba() or .predict_log_proba() or .predict() method"
             )
 
+    def _update(self, batch):
+
+        # y[trace, guess]: the class predicted for the trace under each guess
+        y = np.asarray(self._mapfunction(self._guess_range, batch.values), dtype=np.intp)
+
+        if self.prediction_batch_size is None:
+            log_probas = self._predict_log_probas(batch.leakages)
+        else:
+            log_probas = np.concatenate(
+                [
+                    self._predict_log_probas(batch.leakages[i : i + self.prediction_batch_size])
+                    for i in range(0, len(batch), self.prediction_batch_size)
+                ]
+            )
+
         log_probas = np.nan_to_num(log_probas, False)
 
-        for i in range(len(batch)):
-            self._log_probas += log_probas[i, y[i]]
-            self._log_probas = np.nan_to_num(self._log_probas, False)
+        self._log_probas += np.take_along_axis(log_probas, y, axis=1).sum(0)
+        self._log_probas = np.nan_to_num(self._log_probas, False)
 
     def _finalize(self):
         return self._log_probas
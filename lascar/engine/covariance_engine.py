@@ -0,0 +1,113 @@
+# This file is part of lascar
+#
+# lascar is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+#
+#
+# Copyright 2018 Manuel San Pedro, Victor Servant, Charles Guillemet, Ledger SAS - manuel.sanpedro@ledger.fr, victor.servant@ledger.fr, charles@ledger.fr
+
+"""
+covariance_engine.py
+"""
+import numpy as np
+
+from . import Engine
+
+
+class CovarianceEngine(Engine):
+    """
+    CovarianceEngine is an Engine computing the (sample x sample) covariance matrix of the leakages,
+    or their correlation matrix. (Useful for points of interest selection, whitening, noise analysis, ...)
+
+    The leakages are flattened, so that for a leakage_shape of S samples, the output is of shape (S, S).
+
+    Only the upper triangle of sum(x^T . x) is accumulated, by row panels of block_size samples: each batch costs
+    one GEMM per panel, and about half the operations of a full x^T . x.
+    The accumulation can be done in np.float32 (faster GEMMs) or np.double, and for very wide traces the accumulator
+    can be stored on disk (spill_directory). The results are then also written, panel by panel, in a new memmap in
+    spill_directory at each finalize(), which the Session passes as is (without an in-memory copy) to the
+    OutputMethods. These result files are removed by clean().
+    The leakages are shifted by the mean of the first batch, for numerical stability.
+    """
+
+    def __init__(
+        self, name=None, output="covariance", dtype=np.double, block_size=1024, spill_directory=None
+    ):
+        """
+
+        :param name:
+        :param output: "covariance" or "correlation"
+        :param dtype: dtype of the accumulation: np.float32 or np.double
+        :param block_size: number of samples of the row panels used for the updates
+        :param spill_directory: if set, the (S, S) accumulator and results are stored as memmaps in this directory
+        """
+        if name is None:
+            name = "covariance"
+        if output not in ["covariance", "correlation"]:
+            raise ValueError('output must be "covariance" or "correlation".')
+        Engine.__init__(self, name)
+        self.output = output
+        self._dtype = np.dtype(dtype)
+        self._block_size = block_size
+        self._spill_directory = spill_directory
+        self.output_parser_mode = None
+        self.logger.debug('Creating CovarianceEngine "%s".' % name)
+
+    def _initialize(self):
+        number_of_samples = int(np.prod(self._session.leakage_shape))
+        self._acc_x = np.zeros((number_of_samples,), self._dtype)
+        # only the upper triangle of acc_xx is updated
+        self._acc_xx = self._allocate_accumulator((number_of_samples, number_of_samples), self._dtype)
+        self._shift = None
+        self.size_in_memory += self._acc_x.nbytes
+
+    def _update(self, batch):
+        x = batch.leakages.reshape((len(batch), -1)).astype(self._dtype)
+        if self._shift is None:
+            self._shift = x.mean(0)
+        x -= self._shift
+
+        self._acc_x += x.sum(0)
+        for start in range(0, x.shape[1], self._block_size):
+            stop = min(start + self._block_size, x.shape[1])
+            self._acc_xx[start:stop, start:] += x[:, start:stop].T @ x[:, start:]
+
+    def _finalize(self):
+        n = self._number_of_processed_traces
+        number_of_samples = len(self._acc_x)
+        mean = self._acc_x / n
+        if self._spill_directory is None:
+            results = np.zeros((number_of_samples, number_of_samples), self._dtype)
+        else:
+            results = self._allocate_accumulator((number_of_samples, number_of_samples), self._dtype)
+
+        for start in range(0, number_of_samples, self._block_size):
+            stop = min(start + self._block_size, number_of_samples)
+            panel = self._acc_xx[start:stop, start:] / n - np.outer(mean[start:stop], mean[start:])
+            results[start:stop, start:] = panel
+            results[start:, start:stop] = panel.T
+
+        if self.output == "correlation":
+            std = np.sqrt(np.diag(results))
+            std[std == 0] = np.inf
+            for start in range(0, number_of_samples, self._block_size):
+                stop = min(start + self._block_size, number_of_samples)
+                results[start:stop] /= std[start:stop, None] * std[None, :]
+
+        return results
+
+    def _clean(self):
+        del self._acc_x
+        del self._acc_xx
+        self._remove_spilled_accumulators()
+        self.size_in_memory = 0
@@ -23,6 +23,47 @@ import numpy as np
 
 from . import GuessEngine
 from . import PartitionerEngine
+from .engine import stack_accumulators
+from .guess_engine import get_peak_summaries
+from .guess_engine import get_top_k_peaks
+
+try:
+    from numba import njit
+
+    @njit(nogil=True)
+    def _get_correlation_peaks(acc_xm, acc_m, acc_m2, mean, var, n, pruned, peaks, peak_samples):
+        """
+        Fused finalize of CpaEngine: for each guess, the correlation with the highest absolute value, and its sample,
+        computed directly from the accumulators without any (guess, sample) temporary.
+        The rows of acc_xm of the pruned guesses hold their (frozen) correlations.
+        """
+        for g in range(acc_xm.shape[0]):
+            mean_m = acc_m[g] / n
+            var_m = acc_m2[g] / n - mean_m * mean_m
+            best, best_sample = 0.0, 0
+            for s in range(acc_xm.shape[1]):
+                if pruned[g]:
+                    c = acc_xm[g, s]
+                elif var[s] == 0.0:
+                    c = 0.0
+                else:
+                    numerator = acc_xm[g, s] / n - mean_m * mean[s]
+                    denominator = np.sqrt(var_m * var[s])
+                    if denominator > 0.0:
+                        c = numerator / denominator
+                    elif numerator == 0.0 or np.isnan(numerator):
+                        c = 0.0
+                    else:  # as np.nan_to_num(+-inf)
+                        c = np.finfo(np.double).max if numerator > 0 else -np.finfo(np.double).max
+                    if np.isnan(c):
+                        c = 0.0
+                if s == 0 or abs(c) > abs(best):
+                    best, best_sample = c, s
+            peaks[g] = best
+            peak_samples[g] = best_sample
+
+except Exception:
+    _get_correlation_peaks = None
 
 
 class CpaEngine(GuessEngine):
@@ -37,15 +78,47 @@ class CpaEngine(GuessEngine):
     Given a selection_function on the values under a guess guess (emulating a leakage model),
     Cpa engines computes, for each guess guess, the Pearson's correlation between the output of the selection_function
     and the corresponding leakages.
+
+    For very large guess ranges (16-bit intermediates, ...), the guesses can be processed by chunks fitting in
+    memory_budget bytes, the accumulators can be spilled to disk (spill_directory), and the finalize() can keep only
+    a summary for each guess: the max of |ρ| (the output), and the sample where it is reached (peak_samples).
+    With top_k, the finalize() outputs the k highest peaks of |ρ| for each guess, with their samples and the rank
+    of each guess (see get_peak_summaries()). The summaries are computed chunk by chunk, without allocating the
+    whole correlation matrix.
+    With summary, or top_k=1, the peaks are computed in one fused pass over the accumulators (numba kernel),
+    without any (guess, sample) temporary: dense output steps (eg with ScoreProgressionOutputMethod or
+    RankProgressionOutputMethod) on long traces stay cheap.
+    With pruning_confidence, the guesses that can no longer win (according to Fisher-z confidence intervals)
+    are dropped at each finalize(): the following batches only update the surviving guesses.
     """
 
-    def __init__(self, selection_function, guess_range, name=None, solution=None, jit=True):
+    def __init__(
+        self,
+        selection_function,
+        guess_range,
+        name=None,
+        solution=None,
+        jit=True,
+        memory_budget=None,
+        spill_directory=None,
+        summary=False,
+        top_k=None,
+        pruning_confidence=None,
+    ):
         """
 
         :param name:
         :param selection_function: takes a value and a guess_guess as input, returns a modelisation of the leakage for this (value/guess).
         :param guess_range: what are the values for the guess guess
         :param solution: if known, indicate the correct guess guess.
+        :param memory_budget: if set, maximum size (in bytes) of the temporaries used for a chunk of guesses
+        :param spill_directory: if set, the (guess, sample) accumulator is stored as a memmap in this directory
+        :param summary: if True, finalize() returns, for each guess, the max of |ρ| over the samples
+            (and the flat index of the corresponding sample is stored in peak_samples)
+        :param top_k: if set, finalize() returns the peak summaries of the top_k highest peaks of |ρ| for each guess
+        :param pruning_confidence: if set (eg 0.999), at each finalize() the guesses which can no longer win at this
+            confidence level are pruned: they are not updated anymore, and their correlations are frozen.
+            The pruning is recorded in pruning_history.
         """
         if name is None:
             name = "cpa"
@@ -53,47 +126,199 @@ class CpaEngine(GuessEngine):
         self.logger.debug(
             'Creating CpaEngine "%s" with %d guesses.' % (name, len(guess_range))
         )
+        self._memory_budget = memory_budget
+        self._spill_directory = spill_directory
+        self.summary = summary
+        self.top_k = top_k
+        self._pruning_confidence = pruning_confidence
+        self.peak_samples = None
+        self.pruning_history = []
 
         self.output_parser_mode = "argmax"
 
     def _initialize(self):
-        self.size_in_memory += (
-            np.prod((self._number_of_guesses,) + self._session.leakage_shape)
-            + 2 * self._number_of_guesses
-        ) * 8
-        self._accM = np.zeros((self._number_of_guesses,), np.double)
-        self._accM2 = np.zeros((self._number_of_guesses,), np.double)
-        self._accXM = np.zeros(
-            (self._number_of_guesses,) + self._session.leakage_shape, np.double
-        )
+        self._accM = self._allocate_accumulator((self._number_of_guesses,))
+        self._accM2 = self._allocate_accumulator((self._number_of_guesses,))
+        self._accXM = self._allocate_accumulator((self._number_of_guesses,) + self._session.leakage_shape)
+        self._initialize_pruning()
 
     def _update(self, batch):
-        m = self._mapfunction(self._guess_range, batch.values)
-        self._accM += m.sum(0)
-        self._accM2 += (m ** 2).sum(0)
-        self._accXM += np.dot(m.transpose(), batch.leakages)
+        leakages = batch.leakages.reshape((len(batch), -1))
+        acc_xm = self._accXM.reshape((self._number_of_guesses, -1))
 
-    def _finalize(self):
-        m, v = self._session["mean"].finalize(), self._session["var"].finalize()
-        numerator = (self._accXM / self._number_of_processed_traces) - np.outer(
-            self._accM / self._number_of_processed_traces, m
-        )
-        denominator = np.sqrt(
-            np.outer(
-                self._accM2 / self._number_of_processed_traces
-                - (self._accM / self._number_of_processed_traces) ** 2,
-                v,
-            )
+        for chunk in self._get_active_guess_chunks(8 * (len(batch) + leakages.shape[1])):
+            m = self._get_models(chunk, batch.values)
+            self._accM[chunk] += m.sum(0)
+            self._accM2[chunk] += (m ** 2).sum(0)
+            acc_xm[chunk] += m.T @ leakages
+
+    def _get_models(self, chunk, values):
+        """
+        :return: the outputs of the selection_function for a chunk of guesses: np.array of shape (values, chunk)
+        """
+        return np.asarray(self._mapfunction(self._get_guesses(chunk), values), np.double)
+
+    def _can_be_stacked(self, concatenate=False):
+        """
+        Tell whether the accumulators of this engine can be stacked with others (see _stack_engines()), and updated
+        by _update_stacked() instead of update().
+        With concatenate, the guesses are not chunked along memory_budget.
+        """
+        return (
+            type(self)._update is CpaEngine._update
+            and self._spill_directory is None
+            and self._pruning_confidence is None
+            and (self._memory_budget is None or not concatenate)
         )
+
+    @staticmethod
+    def _stack_engines(engines, concatenate=False):
+        """
+        Make the accumulators of several (initialized) CpaEngines views on stacked accumulators (see stack_accumulators()):
+            - concatenate=True: different CpaEngines (eg of a GroupedEngines), processing the same traces;
+              their guesses are concatenated,
+            - concatenate=False: copies of a same CpaEngine (eg the experiments of a SuccessRateEngine), each
+              processing its own traces; they are stacked along a new first axis.
+
+        :return: the stacked accumulators, to be passed to _update_stacked()
+        """
+        return tuple(stack_accumulators(engines, name, concatenate) for name in ("_accM", "_accM2", "_accXM"))
+
+    @staticmethod
+    def _update_stacked(engines, stacked_accumulators, batch, weights=None):
+        """
+        Update at once several CpaEngines, whose accumulators have been stacked by _stack_engines():
+            - weights=None (concatenated engines): all the engines process the whole batch, with one single GEMM,
+            - otherwise (copies of a same engine): the engine i processes the trace j weights[i, j] times;
+              the models are computed once for all the engines.
+        """
+        acc_m, acc_m2, acc_xm = stacked_accumulators
+        leakages = batch.leakages.reshape((len(batch), -1))
+
+        if weights is None:
+            m = np.concatenate([e._get_models(slice(None), batch.values) for e in engines], 1)
+            acc_m += m.sum(0)
+            acc_m2 += (m ** 2).sum(0)
+            acc_xm.reshape((len(acc_m), -1))[...] += m.T @ leakages
+            for e in engines:
+                e._add_processed_traces(len(batch))
+            return
+
+        leakages = leakages.astype(np.double)
+        acc_xm = acc_xm.reshape(acc_xm.shape[:2] + (-1,))
+        traces = [np.flatnonzero(w) for w in weights]
+        for chunk in engines[0]._get_guess_chunks(8 * (len(batch) + leakages.shape[1])):
+            m = engines[0]._get_models(chunk, batch.values)
+            acc_m[:, chunk] += weights @ m
+            acc_m2[:, chunk] += weights @ m ** 2
+            for i, t in enumerate(traces):
+                if len(t):
+                    acc_xm[i, chunk] += m[t].T @ (weights[i, t, None] * leakages[t])
+        for e, w in zip(engines, weights):
+            e._add_processed_traces(w.sum())
+
+    def _get_correlations(self, chunk, m, v):
+        """
+        Correlations for a chunk of guesses (slice or indexes), given the mean m and variance v of the leakages.
+        The rows of the pruned guesses hold their correlations frozen when they were pruned.
+        """
+        acc_xm = self._accXM.reshape((self._number_of_guesses, -1))
+        mean_m = self._accM[chunk] / self._number_of_processed_traces
+        var_m = self._accM2[chunk] / self._number_of_processed_traces - mean_m ** 2
+
+        numerator = (acc_xm[chunk] / self._number_of_processed_traces) - np.outer(mean_m, m)
+        denominator = np.sqrt(np.outer(var_m, v))
         mask = v == 0.0
         numerator[:, mask] = 0.0
         denominator[:, mask] = 1.0
-        return np.nan_to_num(numerator / denominator)
+        correlations = np.nan_to_num(numerator / denominator)
+
+        pruned = self._pruned[chunk]
+        if pruned.any():
+            correlations[pruned] = acc_xm[chunk][pruned]
+        return correlations
+
+    def _finalize(self):
+        m, v = self._session["mean"].finalize().ravel(), self._session["var"].finalize().ravel()
+        scores = None if self._pruning_confidence is None else np.zeros((self._number_of_guesses,), np.double)
+
+        if (self.summary or self.top_k == 1) and _get_correlation_peaks is not None:
+            return self._finalize_fused(m, v)
+
+        memory_budget = None
+        if self.top_k is not None:
+            results = np.zeros((self._number_of_guesses, min(self.top_k, len(m))), np.double)
+            self.peak_samples = np.zeros(results.shape, np.intp)
+            memory_budget = self._summary_memory_budget
+        elif self.summary:
+            results = np.zeros((self._number_of_guesses,), np.double)
+            self.peak_samples = np.zeros((self._number_of_guesses,), np.intp)
+            memory_budget = self._summary_memory_budget
+        else:
+            results = np.zeros((self._number_of_guesses, len(m)), np.double)
+
+        for chunk in self._get_guess_chunks(8 * 3 * len(m), memory_budget):
+            correlations = self._get_correlations(chunk, m, v)
+            if scores is not None:
+                scores[chunk] = np.abs(correlations).max(1)
+
+            if self.top_k is not None:
+                results[chunk], self.peak_samples[chunk] = get_top_k_peaks(correlations, self.top_k, absolute=True)
+            elif self.summary:
+                correlations = np.abs(correlations)
+                self.peak_samples[chunk] = correlations.argmax(1)
+                results[chunk] = correlations.max(1)
+            else:
+                results[chunk] = correlations
+
+        if scores is not None:
+            self._prune(scores, m, v)
+
+        if self.top_k is not None:
+            return get_peak_summaries(results, self.peak_samples, absolute=True)
+        if self.summary:
+            return results
+        return results.reshape((self._number_of_guesses,) + self._session.leakage_shape)
+
+    def _finalize_fused(self, m, v):
+        """
+        finalize() when only the highest peak of each guess is needed (summary, or top_k=1):
+        one pass over the accumulators, with the fused kernel _get_correlation_peaks.
+        """
+        peaks = np.zeros((self._number_of_guesses,), np.double)
+        peak_samples = np.zeros((self._number_of_guesses,), np.intp)
+        _get_correlation_peaks(
+            np.asarray(self._accXM).reshape((self._number_of_guesses, -1)),
+            np.asarray(self._accM),
+            np.asarray(self._accM2),
+            m,
+            v,
+            float(self._number_of_processed_traces),
+            self._pruned,
+            peaks,
+            peak_samples,
+        )
+        if self._pruning_confidence is not None:
+            self._prune(np.abs(peaks), m, v)
+
+        if self.top_k is not None:
+            self.peak_samples = peak_samples[:, None]
+            return get_peak_summaries(peaks[:, None], self.peak_samples, absolute=True)
+        self.peak_samples = peak_samples
+        return np.abs(peaks)
+
+    def _prune(self, scores, m, v):
+        # the correlations of the pruned guesses are frozen inside their (now unused) accumulator
+        to_prune = self._get_guesses_to_prune(scores)
+        for chunk in self._get_index_chunks(to_prune, 8 * 3 * len(m), self._summary_memory_budget):
+            self._accXM.reshape((self._number_of_guesses, -1))[chunk] = self._get_correlations(chunk, m, v)
+        self._pruned[to_prune] = True
 
     def _clean(self):
         del self._accM
         del self._accM2
         del self._accXM
+        self._remove_spilled_accumulators()
         self.size_in_memory = 0
 
 
@@ -178,3 +403,267 @@ class CpaPartitionedEngine(PartitionerEngine, GuessEngine):
         del self._accM2
         del self._accXM
         self.size_in_memory = 0
+
+
+class ModelBankCpaEngine(PartitionerEngine, GuessEngine):
+    """
+    ModelBankCpaEngine is a PartitionerEngine and a GuessEngine (as CpaPartitionedEngine) evaluating a whole bank of
+    leakage models at once.
+
+    All the leakage models (hamming weight, single bits, weighted bits, ...) are functions of the same
+    partitioned value. Hence one single partition accumulator holds enough information to compute
+    the correlation of every (model, guess) couple: the per-batch cost does not depend on the number of models.
+
+    For each guess, and for each model of the bank, the engine outputs the Pearson's correlation between
+    leakage_model(selection_function(partition_value, guess)) and the leakages.
+    The results are indexed as results[guess, model, sample].
+    """
+
+    def __init__(
+        self,
+        partition_function,
+        partition_range,
+        selection_function,
+        guess_range,
+        leakage_models,
+        name=None,
+        solution=None,
+        jit=True,
+    ):
+        """
+
+        :param partition_function: partition_function, takes a value and returns an int within partition_range
+        :param partition_range: what are the possible outputs for the partition
+        :param selection_function: takes (partition_value,guess) as an input, returns the targeted intermediate value
+        :param guess_range: what are the possible outputs for the guess guess
+        :param leakage_models: list of leakage models (callables) applied on the output of selection_function
+        :param solution: if known, indicate the correct guess guess.
+        :param jit: jit the partition_function
+        """
+        if name is None:
+            name = "model_bank_cpa"
+        PartitionerEngine.__init__(
+            self, partition_function, partition_range, 1, name=name, jit=jit
+        )
+        GuessEngine.__init__(
+            self, selection_function, guess_range, name=name, solution=solution, jit=False
+        )
+        self._leakage_models = list(leakage_models)
+        self._number_of_models = len(self._leakage_models)
+        self.output_parser_mode = "argmax"
+        self.logger.debug(
+            'Creating ModelBankCpaEngine "%s" with %d partitions, %d guesses, %d models.'
+            % (name, self._partition_size, self._number_of_guesses, self._number_of_models)
+        )
+
+    def _initialize(self):
+        PartitionerEngine._initialize(self)
+
+        # intermediate[guess, partition]: computed once, shared by all the models
+        intermediate = np.array(
+            [
+                [self._function(v, guess) for v in self._partition_range]
+                for guess in self._guess_range
+            ]
+        )
+
+        # models[guess, model, partition]
+        self._models = np.zeros(
+            (self._number_of_guesses, self._number_of_models, self._partition_size),
+            np.double,
+        )
+        for i, leakage_model in enumerate(self._leakage_models):
+            self._models[:, i] = self._apply_model(leakage_model, intermediate)
+        self.size_in_memory += self._models.nbytes
+
+    @staticmethod
+    def _apply_model(leakage_model, intermediate):
+        """
+        Apply leakage_model on the whole intermediate array at once, or value by value if it does not broadcast.
+        """
+        try:
+            res = np.asarray(leakage_model(intermediate), dtype=np.double)
+            if res.shape == intermediate.shape:
+                return res
+        except (TypeError, ValueError):
+            # eg a model written for scalars (int(value), if value > 3, ...)
+            pass
+        return np.vectorize(leakage_model, otypes=[np.double])(intermediate)
+
+    def _finalize(self):
+        n = self._number_of_processed_traces
+        models = self._models.reshape(-1, self._partition_size)
+        acc_x = self._acc_x_by_partition[0].reshape(self._partition_size, -1)
+
+        accXM = (models @ acc_x) / n
+        accM = (models @ self._partition_count) / n
+        accM2 = ((models ** 2) @ self._partition_count) / n
+
+        m, v = self._session["mean"].finalize(), self._session["var"].finalize()
+        m, v = m.reshape(-1), v.reshape(-1)
+
+        numerator = accXM - np.outer(accM, m)
+        denominator = np.sqrt(np.outer(accM2 - accM ** 2, v))
+        mask = v == 0.0
+        numerator[:, mask] = 0.0
+        denominator[:, mask] = 1.0
+        return np.nan_to_num(numerator / denominator).reshape(
+            (self._number_of_guesses, self._number_of_models)
+            + self._session.leakage_shape
+        )
+
+    def _clean(self):
+        del self._models
+        PartitionerEngine._clean(self)
+
+
+class SecondOrderCpaEngine(GuessEngine):
+    """
+    SecondOrderCpaEngine is a GuessEngine used to perform second-order Correlation Power Analysis.
+
+    For each guess, and each pair of samples (i, j), it computes the Pearson's correlation between the output of the
+    selection_function and the centered product (l[i] - E[l[i]]) * (l[j] - E[l[j]]), as CpaEngine would do on traces
+    preprocessed by CenteredProductProcessing.
+
+    The centered products are never built: the engine streams raw moment accumulators (sum(m * l[i] * l[j]),
+    sum(l[i]^a * l[j]^b), ...), updated with blocked matrix products tiled over the pair space, and the centering
+    with the mean from the Session MeanEngine is done at finalize.
+
+    The pairs can be selected with rois=(roi_0, roi_1): all pairs in roi_0 x roi_1, and the results are indexed as
+    results[guess, i, j] for i in roi_0, j in roi_1. If rois is not set, all pairs of samples are used.
+    """
+
+    def __init__(
+        self,
+        selection_function,
+        guess_range,
+        rois=None,
+        memory_budget=2 ** 26,
+        name=None,
+        solution=None,
+        jit=True,
+    ):
+        """
+
+        :param selection_function: takes a value and a guess_guess as input, returns a modelisation of the leakage for this (value/guess).
+        :param guess_range: what are the values for the guess guess
+        :param rois: optional, two lists of samples indexes: the pairs are roi_0 x roi_1
+        :param memory_budget: maximum size (in bytes) of the temporaries used by a tile of pairs
+        :param solution: if known, indicate the correct guess guess.
+        """
+        if name is None:
+            name = "second_order_cpa"
+        GuessEngine.__init__(self, selection_function, guess_range, solution=solution, name=name, jit=jit)
+        self.logger.debug(
+            'Creating SecondOrderCpaEngine "%s" with %d guesses.' % (name, len(guess_range))
+        )
+        self._rois = rois
+        self._memory_budget = memory_budget
+        self.output_parser_mode = "argmax"
+
+    def _initialize(self):
+        number_of_samples = int(np.prod(self._session.leakage_shape))
+        if self._rois is None:
+            self._roi_0 = self._roi_1 = np.arange(number_of_samples)
+        else:
+            self._roi_0, self._roi_1 = (np.array(roi, dtype=np.intp) for roi in self._rois)
+        pairs_shape = (len(self._roi_0), len(self._roi_1))
+
+        self._accM = np.zeros((self._number_of_guesses,), np.double)
+        self._accM2 = np.zeros((self._number_of_guesses,), np.double)
+        # accYM[g, i] = sum(m * y[i])
+        self._accYM = np.zeros((self._number_of_guesses, number_of_samples), np.double)
+        # accYYM[g, i, j] = sum(m * y[i] * y[j])
+        self._accYYM = np.zeros((self._number_of_guesses,) + pairs_shape, np.double)
+        # acc_pairs[2 * (a - 1) + (b - 1), i, j] = sum( y[i]^a * y[j]^b )
+        self._acc_pairs = np.zeros((4,) + pairs_shape, np.double)
+        self._accY2 = np.zeros((number_of_samples,), np.double)
+
+        # y = l - shift: the shift (the mean of the first batch) improves the numerical stability
+        self._shift = None
+
+        self.size_in_memory += (
+            self._accYM.nbytes + self._accYYM.nbytes + self._acc_pairs.nbytes
+        )
+
+    def _update(self, batch):
+        m = self._mapfunction(self._guess_range, batch.values).astype(np.double)
+        leakages = batch.leakages.reshape((len(batch), -1)).astype(np.double)
+        if self._shift is None:
+            self._shift = leakages.mean(0)
+        y = leakages - self._shift
+        y2 = y * y
+
+        self._accM += m.sum(0)
+        self._accM2 += (m ** 2).sum(0)
+        self._accYM += m.T @ y
+        self._accY2 += y2.sum(0)
+
+        y_1, y2_1 = y[:, self._roi_1], y2[:, self._roi_1]
+        tile_size = max(
+            1,
+            self._memory_budget
+            // (8 * len(self._roi_1) * (len(batch) + self._number_of_guesses + 4)),
+        )
+        for start in range(0, len(self._roi_0), tile_size):
+            tile = slice(start, start + tile_size)
+            y_0, y2_0 = y[:, self._roi_0[tile]], y2[:, self._roi_0[tile]]
+
+            products = (y_0[:, :, None] * y_1[:, None, :]).reshape((len(batch), -1))
+            self._accYYM[:, tile] += (m.T @ products).reshape(
+                (self._number_of_guesses, -1, len(self._roi_1))
+            )
+
+            self._acc_pairs[0, tile] += y_0.T @ y_1
+            self._acc_pairs[1, tile] += y_0.T @ y2_1
+            self._acc_pairs[2, tile] += y2_0.T @ y_1
+            self._acc_pairs[3, tile] += y2_0.T @ y2_1
+
+    def _finalize(self):
+        n = self._number_of_processed_traces
+        e_y = self._session["mean"].finalize().reshape(-1) - self._shift
+        e_y2 = self._accY2 / n
+
+        a, a2 = e_y[self._roi_0][:, None], e_y2[self._roi_0][:, None]
+        b, b2 = e_y[self._roi_1][None, :], e_y2[self._roi_1][None, :]
+        e_11, e_12, e_21, e_22 = self._acc_pairs / n
+
+        # centered products p = (y[i] - a)(y[j] - b): mean and variance
+        e_p = e_11 - a * b
+        e_p2 = (
+            e_22
+            - 2 * b * e_21
+            - 2 * a * e_12
+            + 4 * a * b * e_11
+            + b ** 2 * a2
+            + a ** 2 * b2
+            - 3 * a ** 2 * b ** 2
+        )
+        v_p = e_p2 - e_p ** 2
+
+        e_m = self._accM / n
+        v_m = self._accM2 / n - e_m ** 2
+        e_ym = self._accYM / n
+
+        # E[m * p]
+        e_mp = (
+            self._accYYM / n
+            - b[None] * e_ym[:, self._roi_0][:, :, None]
+            - a[None] * e_ym[:, self._roi_1][:, None, :]
+            + (a * b)[None] * e_m[:, None, None]
+        )
+        numerator = e_mp - e_m[:, None, None] * e_p[None]
+        denominator = np.sqrt(v_m[:, None, None] * v_p[None])
+        mask = v_p <= 0.0
+        numerator[:, mask] = 0.0
+        denominator[:, mask] = 1.0
+        return np.nan_to_num(numerator / denominator)
+
+    def _clean(self):
+        del self._accM
+        del self._accM2
+        del self._accYM
+        del self._accYYM
+        del self._acc_pairs
+        del self._accY2
+        self.size_in_memory = 0
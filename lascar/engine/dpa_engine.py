@@ -22,6 +22,8 @@ dpa_lsb_engine.py
 import numpy as np
 
 from . import GuessEngine
+from .guess_engine import get_peak_summaries
+from .guess_engine import get_top_k_peaks
 
 
 class DpaEngine(GuessEngine):
@@ -37,61 +39,108 @@ class DpaEngine(GuessEngine):
 
     """
 
-    def __init__(self, selection_function, guess_range, name=None, solution=None):
+    def __init__(
+        self,
+        selection_function,
+        guess_range,
+        name=None,
+        solution=None,
+        jit=True,
+        memory_budget=None,
+        spill_directory=None,
+        summary=False,
+        top_k=None,
+    ):
         """
 
         :param name:
         :param selection_function: takes a value and a guess_guess as input, returns 0 or 1.
         :param guess_range: what are the values for the guess guess
         :param solution: if known, indicate the correct guess guess.
+        :param memory_budget: if set, maximum size (in bytes) of the temporaries used for a chunk of guesses
+        :param spill_directory: if set, the (guess, class, sample) accumulator is stored as a memmap in this directory
+        :param summary: if True, finalize() returns, for each guess, the max over the samples
+            (and the flat index of the corresponding sample is stored in peak_samples)
+        :param top_k: if set, finalize() returns the peak summaries of the top_k highest peaks for each guess
+            (see get_peak_summaries())
         """
         if name is None:
             name = "dpa"
-        GuessEngine.__init__(self, selection_function, guess_range, solution=solution, name=name)
+        GuessEngine.__init__(self, selection_function, guess_range, solution=solution, name=name, jit=jit)
+        self._memory_budget = memory_budget
+        self._spill_directory = spill_directory
+        self.summary = summary
+        self.top_k = top_k
+        self.peak_samples = None
         self.output_parser_mode = "max"
         self.logger.debug(
             'Creating DpaEngine "%s" with %d guesses.', name, len(guess_range)
         )
 
     def _initialize(self):
-        self._acc_x = np.zeros(
-            (self._number_of_guesses, 2,) + self._session.leakage_shape, np.double
+        self._acc_x = self._allocate_accumulator(
+            (self._number_of_guesses, 2,) + self._session.leakage_shape
         )
-        self._count_x = np.zeros((self._number_of_guesses, 2,), np.double)
+        self._count_x = self._allocate_accumulator((self._number_of_guesses, 2,))
 
     def _update(self, batch):
-        y = np.array(
-            [
-                [self._function(d, guess) for guess in self._guess_range]
-                for d in batch.values
-            ]
-        )
-
-        for i in range(len(batch)):
-            y = np.array(
-                [self._function(batch.values[i], guess) for guess in self._guess_range]
-            )
+        leakages = batch.leakages.reshape((len(batch), -1))
+        acc_x = self._acc_x.reshape((self._number_of_guesses, 2, -1))
 
-            idx_0 = np.where(y == 0)[0]
-            idx_1 = np.where(y == 1)[0]
+        for chunk in self._get_guess_chunks(8 * 2 * (len(batch) + leakages.shape[1])):
+            # y[trace, guess]: selection bit for each trace under each guess of the chunk
+            y = np.asarray(self._mapfunction(self._guess_range[chunk], batch.values))
+            y0 = (y == 0).astype(np.double)
+            y1 = (y == 1).astype(np.double)
 
-            self._acc_x[idx_0, 0] += batch.leakages[i]
-            self._count_x[idx_0, 0] += len(idx_0)
+            acc_x[chunk, 0] += y0.T @ leakages
+            acc_x[chunk, 1] += y1.T @ leakages
 
-            self._acc_x[idx_1, 1] += batch.leakages[i]
-            self._count_x[idx_1, 1] += len(idx_1)
+            self._count_x[chunk, 0] += y0.sum(0)
+            self._count_x[chunk, 1] += y1.sum(0)
 
     def _finalize(self):
         """
         for each guess, returns the square of difference of the means of the two classes
         """
-        return np.nan_to_num(
-            [
-                (
-                    (self._acc_x[guess, 1] / self._count_x[guess, 1])
-                    - (self._acc_x[guess, 0] / self._count_x[guess, 0])
+        acc_x = self._acc_x.reshape((self._number_of_guesses, 2, -1))
+        memory_budget = None
+        if self.top_k is not None:
+            results = np.zeros((self._number_of_guesses, min(self.top_k, acc_x.shape[2])), np.double)
+            self.peak_samples = np.zeros(results.shape, np.intp)
+            memory_budget = self._summary_memory_budget
+        elif self.summary:
+            results = np.zeros((self._number_of_guesses,), np.double)
+            self.peak_samples = np.zeros((self._number_of_guesses,), np.intp)
+            memory_budget = self._summary_memory_budget
+        else:
+            results = np.zeros((self._number_of_guesses, acc_x.shape[2]), np.double)
+
+        for chunk in self._get_guess_chunks(8 * 3 * acc_x.shape[2], memory_budget):
+            with np.errstate(divide="ignore", invalid="ignore"):
+                differences = np.nan_to_num(
+                    (
+                        (acc_x[chunk, 1] / self._count_x[chunk, 1, None])
+                        - (acc_x[chunk, 0] / self._count_x[chunk, 0, None])
+                    )
+                    ** 2
                 )
-                ** 2
-                for guess in self._guess_range
-            ]
-        )
+            if self.top_k is not None:
+                results[chunk], self.peak_samples[chunk] = get_top_k_peaks(differences, self.top_k)
+            elif self.summary:
+                self.peak_samples[chunk] = differences.argmax(1)
+                results[chunk] = differences.max(1)
+            else:
+                results[chunk] = differences
+
+        if self.top_k is not None:
+            return get_peak_summaries(results, self.peak_samples)
+        if self.summary:
+            return results
+        return results.reshape((self._number_of_guesses,) + self._session.leakage_shape)
+
+    def _clean(self):
+        del self._acc_x
+        del self._count_x
+        self._remove_spilled_accumulators()
+        self.size_in_memory = 0
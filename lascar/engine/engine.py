@@ -19,7 +19,13 @@
 """
 engine.py
 """
+import functools
 import logging
+import os
+import shutil
+import tempfile
+from threading import Thread
+
 import numpy as np
 from lascar.output.parse_results import parse_output_basic
 
@@ -36,6 +42,9 @@ class Engine:
 
     """
 
+    # directory where the accumulators are spilled (as .npy memmaps). None: the accumulators stay in memory
+    _spill_directory = None
+
     def __init__(self, name):
         """
         :param name: the name chosen for the Engine
@@ -80,13 +89,42 @@ class Engine:
 
         self.logger.debug("%s Engine updating .", self.name)
         self._update(batch)
-        self._number_of_processed_traces += len(batch)
+        self._add_processed_traces(len(batch))
+
+    def _add_processed_traces(self, number_of_traces):
+        """
+        Account for processed traces: called by update(), or by a stacked update of several engines at once
+        (see stack_accumulators()).
+        """
+        self._number_of_processed_traces += int(number_of_traces)
 
     def finalize(self):
         self.logger.debug("Engine %s Finalizing.", self.name)
         self.finalize_step.append(self._number_of_processed_traces)
         return self._finalize()
 
+    def _allocate_accumulator(self, shape, dtype=np.double):
+        """
+        Allocate a zeroed accumulator: in memory, or as a .npy memmap in _spill_directory.
+        The memory used is added to size_in_memory only for in-memory accumulators.
+        """
+        if self._spill_directory is None:
+            accumulator = np.zeros(shape, dtype)
+            self.size_in_memory += accumulator.nbytes
+            return accumulator
+
+        if getattr(self, "_spill_path", None) is None:
+            self._spill_path = tempfile.mkdtemp(prefix="lascar_%s_" % self.name, dir=self._spill_directory)
+        filename = os.path.join(self._spill_path, "accumulator_%d.npy" % len(os.listdir(self._spill_path)))
+        accumulator = np.lib.format.open_memmap(filename, mode="w+", dtype=dtype, shape=shape)
+        accumulator[...] = 0.0
+        return accumulator
+
+    def _remove_spilled_accumulators(self):
+        if getattr(self, "_spill_path", None) is not None:
+            shutil.rmtree(self._spill_path, ignore_errors=True)
+            self._spill_path = None
+
     def get_results():
         return self.finalize()
 
@@ -280,22 +318,155 @@ class GroupedEngines(Engine):
     """
     GroupedEngines is an abstact engine whose role regroup engines within one.
     Useful when performing multiple charac/attacks at the same time.
+
+    When the Session runs with thread_on_update, the engines of the group are updated (and finalized) in parallel
+    threads, as the Session does for its own engines.
+    The CpaEngines of the group keeping the default update (without memory_budget, spill_directory nor
+    pruning_confidence) are fused: their accumulators are stacked, and all of them are updated with one single
+    matrix product per batch.
     """
 
-    def __init__(self, name, *engines):
+    def __init__(self, name, *engines, fuse=True):
+        """
+
+        :param name:
+        :param engines: the engines to be grouped (not registered to the Session)
+        :param fuse: if False, the CpaEngines are never fused
+        """
         Engine.__init__(self, name)
         self.engines = engines
+        self._fuse = fuse
 
     def _initialize(self):
         [e.initialize(self._session) for e in self.engines]
 
+        # (the engines able to update their accumulators stacked with others are CpaEngines)
+        self._fused_engines = [
+            e for e in self.engines if self._fuse and getattr(e, "_can_be_stacked", lambda _: False)(True)
+        ]
+        if len(self._fused_engines) < 2:
+            self._fused_engines = []
+        self._other_engines = [e for e in self.engines if all(e is not f for f in self._fused_engines)]
+
+        if self._fused_engines:
+            self._stacked_accumulators = self._fused_engines[0]._stack_engines(self._fused_engines, concatenate=True)
+
+    def _run(self, tasks):
+        """
+        Run the tasks (functions without arguments), in parallel threads if the Session threads its updates.
+        """
+        if len(tasks) < 2 or not getattr(self._session, "_thread_on_update", False):
+            return [task() for task in tasks]
+
+        results = [None] * len(tasks)
+
+        def run_task(i):
+            results[i] = tasks[i]()
+
+        threads = [Thread(target=run_task, args=(i,)) for i in range(len(tasks))]
+        [thread.start() for thread in threads]
+        [thread.join() for thread in threads]
+        return results
+
     def _update(self, batch):
-        [e.update(batch) for e in self.engines]
+        tasks = [functools.partial(e.update, batch) for e in self._other_engines]
+        if self._fused_engines:
+            tasks.append(
+                functools.partial(
+                    self._fused_engines[0]._update_stacked, self._fused_engines, self._stacked_accumulators, batch
+                )
+            )
+        self._run(tasks)
 
     def _finalize(self):
 
-        result = [e.finalize() for e in self.engines]
+        result = self._run([e.finalize for e in self.engines])
         if isinstance(result[0], np.ndarray):
             return np.array(result)
         else:
             return result
+
+
+def stack_accumulators(engines, attribute, concatenate=False, allocate=None):
+    """
+    Make the accumulators named attribute of several engines views on one single stacked accumulator, so that they
+    can all be updated at once (eg with one matrix product per batch).
+
+    :param engines: the (initialized) engines owning the accumulators
+    :param attribute: the name of the accumulator
+    :param concatenate: if True, the accumulators are concatenated along their first axis (eg the guesses of several
+        CpaEngines), otherwise they are stacked along a new first axis (eg replicates of a same engine)
+    :param allocate: if set, allocates the stacked accumulator from its shape and dtype
+        (eg Engine._allocate_accumulator, to spill it), instead of building it in memory
+    :return: the stacked accumulator
+    """
+    accumulators = [getattr(engine, attribute) for engine in engines]
+    if allocate is not None:
+        shape = accumulators[0].shape
+        if concatenate:
+            shape = (sum(len(accumulator) for accumulator in accumulators),) + shape[1:]
+        else:
+            shape = (len(accumulators),) + shape
+        stacked = allocate(shape, accumulators[0].dtype)
+        if concatenate:
+            np.concatenate(accumulators, out=stacked)
+        else:
+            np.stack(accumulators, out=stacked)
+    elif concatenate:
+        stacked = np.concatenate(accumulators)
+    else:
+        stacked = np.stack(accumulators)
+
+    if not concatenate:
+        for engine, accumulator in zip(engines, stacked):
+            setattr(engine, attribute, accumulator)
+        return stacked
+
+    start = 0
+    for engine, accumulator in zip(engines, accumulators):
+        setattr(engine, attribute, stacked[start : start + len(accumulator)])
+        start += len(accumulator)
+    return stacked
+
+
+class _StackedMeanVar:
+    """
+    The 'mean' and 'var' engines of several _EngineSessions (bootstrap replicates, experiments, ...), updated at once:
+    each trace of a batch is processed weights[i, trace] times by the session i.
+    """
+
+    def __init__(self, sessions):
+        self._means = [session["mean"] for session in sessions]
+        self._vars = [session["var"] for session in sessions]
+        self._acc_x = stack_accumulators(self._means, "_acc_x")
+        self._acc_x2 = stack_accumulators(self._vars, "_acc_x2")
+
+    def update(self, leakages, weights):
+        """
+        :param leakages: the leakages of a batch, flattened: np.array of shape (batch, samples)
+        :param weights: np.array of shape (sessions, batch)
+        """
+        self._acc_x.reshape((len(weights), -1))[...] += weights @ leakages
+        self._acc_x2.reshape((len(weights), -1))[...] += weights @ leakages ** 2
+        for mean, var, number_of_traces in zip(self._means, self._vars, weights.sum(1)):
+            mean._add_processed_traces(number_of_traces)
+            var._add_processed_traces(number_of_traces)
+
+
+class _EngineSession:
+    """
+    Stands for the Session of an engine driven by another engine (a bootstrap replicate, a guess shard, ...):
+    it gives to the engine the same leakage_shape and container as the real Session, but its own 'mean' and 'var'
+    engines, computed on the traces the engine is actually given.
+    """
+
+    def __init__(self, session):
+        self.container = session.container
+        self.leakage_shape = session.leakage_shape
+        self.value_shape = session.value_shape
+        self.engines = {"mean": MeanEngine(), "var": VarEngine()}
+        for engine in self.engines.values():
+            engine.initialize(self)
+
+    def __getitem__(self, item):
+        return self.engines[item]
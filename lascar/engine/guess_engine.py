@@ -32,8 +32,20 @@ class GuessEngine(Engine):
      It requires a selection_function taking as an input the trace value and a guess guess which lives in guess_range.
 
     In the case where the solution is known, it can be passed as an argument.
+
+    For very large guess ranges, subclasses can process the guesses by chunks (see _get_guess_chunks()),
+    and allocate their accumulators on disk (see Engine._allocate_accumulator()).
+    They can also drop, along the run, the guesses that can no longer win (see _get_guesses_to_prune()):
+    the following batches then only update the surviving guesses (see _get_active_guess_chunks()).
     """
 
+    # maximum size (in bytes) of the per-chunk temporaries. None: all the guesses are processed at once
+    _memory_budget = None
+    # memory budget used by default when finalize() only keeps summaries of the results
+    _summary_memory_budget = 2 ** 26
+    # confidence level of the bounds used to prune the guesses. None: no pruning
+    _pruning_confidence = None
+
     def __init__(self, selection_function, guess_range, name=None, solution=None, jit=True):
         """
 
@@ -46,7 +58,6 @@ class GuessEngine(Engine):
         self._function = selection_function
         self._guess_range = list(guess_range)
         self._number_of_guesses = len(guess_range)
-        self._guess_range_to_index = {j: i for i, j in enumerate(self._guess_range)}
         self.solution = solution
         self.jit = jit
         if self.jit:
@@ -81,3 +92,127 @@ class GuessEngine(Engine):
         return np.array(
             [[self._function(d, guess) for guess in guess_range] for d in batch]
         )
+
+    def _get_guess_chunks(self, bytes_per_guess, memory_budget=None):
+        """
+        Split the guess range into chunks, such that each chunk needs at most _memory_budget bytes.
+
+        :param bytes_per_guess: size (in bytes) of the temporaries needed for one guess
+        :param memory_budget: if set, used instead of _memory_budget
+        :return: list of slices over the guess indexes
+        """
+        if memory_budget is None:
+            memory_budget = self._memory_budget
+        if memory_budget is None:
+            chunk_size = self._number_of_guesses
+        else:
+            chunk_size = max(1, int(memory_budget // bytes_per_guess))
+        return [
+            slice(start, min(start + chunk_size, self._number_of_guesses))
+            for start in range(0, self._number_of_guesses, chunk_size)
+        ]
+
+    def _get_active_guess_chunks(self, bytes_per_guess):
+        """
+        Same as _get_guess_chunks(), restricted to the guesses which have not been pruned.
+
+        :return: list of slices (if no guess has been pruned) or of arrays of guess indexes
+        """
+        pruned = getattr(self, "_pruned", None)
+        if pruned is None or not pruned.any():
+            return self._get_guess_chunks(bytes_per_guess)
+
+        return self._get_index_chunks(np.flatnonzero(~pruned), bytes_per_guess)
+
+    def _get_index_chunks(self, indexes, bytes_per_guess, memory_budget=None):
+        """
+        Split an array of guess indexes into chunks, as _get_guess_chunks() does for the whole guess range.
+        """
+        return [
+            indexes[chunk]
+            for chunk in self._get_guess_chunks(bytes_per_guess, memory_budget)
+            if chunk.start < len(indexes)
+        ]
+
+    def _get_guesses(self, chunk):
+        """
+        :param chunk: slice or array of guess indexes
+        :return: the corresponding guesses, as expected by _mapfunction
+        """
+        if isinstance(chunk, slice) or not isinstance(self._guess_range, list):
+            return self._guess_range[chunk]
+        return [self._guess_range[i] for i in chunk]
+
+    def _initialize_pruning(self):
+        self._pruned = np.zeros((self._number_of_guesses,), dtype=bool)
+        self.pruning_history = []
+
+    def _get_guesses_to_prune(self, scores):
+        """
+        Sequential pruning with Fisher-z confidence intervals on the correlations.
+
+        With n traces, atanh(ρ) is approximately normal with standard deviation 1/sqrt(n-3).
+        A guess is pruned when the upper bound of its score is below the lower bound of the best score,
+        at the confidence level _pruning_confidence.
+        The pruning is recorded in pruning_history, as (number of traces, pruned guesses).
+
+        :param scores: for each guess, the max of |ρ| over the samples
+        :return: indexes of the guesses to prune (not yet marked in _pruned)
+        """
+        n = self._number_of_processed_traces
+        active = ~self._pruned
+        if self._pruning_confidence is None or n <= 3 or active.sum() <= 1:
+            return np.zeros((0,), np.intp)
+
+        from scipy.stats import norm
+
+        z = np.arctanh(np.clip(scores, 0.0, 1.0 - 1e-12))
+        margin = norm.ppf(1 - (1 - self._pruning_confidence) / 2) / np.sqrt(n - 3)
+        to_prune = np.flatnonzero(active & (z + margin < z[active].max() - margin))
+
+        if len(to_prune):
+            self.pruning_history.append((n, [self._guess_range[i] for i in to_prune]))
+            self.logger.debug(
+                'Engine "%s": %d guesses pruned after %d traces, %d remaining.'
+                % (self.name, len(to_prune), n, active.sum() - len(to_prune))
+            )
+        return to_prune
+
+
+def get_top_k_peaks(results, k, absolute=False):
+    """
+    For each row (guess) of results, find the k highest peaks, sorted by decreasing order.
+
+    :param results: np.array of shape (guesses, samples)
+    :param k: number of peaks to keep (at most the number of samples)
+    :param absolute: if True, the peaks are the highest in absolute value (the signed values are returned)
+    :return: (values, samples), two np.array of shape (guesses, k)
+    """
+    scores = np.abs(results) if absolute else results
+    k = min(k, scores.shape[1])
+    samples = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+    order = np.argsort(-np.take_along_axis(scores, samples, 1), axis=1, kind="stable")
+    samples = np.take_along_axis(samples, order, 1)
+    return np.take_along_axis(results, samples, 1), samples
+
+
+def get_peak_summaries(values, samples, absolute=False):
+    """
+    Pack the top-k peaks of each guess into a structured np.array of shape (guesses,), with fields:
+        - 'peaks': the k peak values, sorted by decreasing order (of absolute value if absolute)
+        - 'samples': the flat indexes of the corresponding samples
+        - 'rank': the rank of the guess, according to its highest peak (1 for the best guess)
+
+    Such results are consumed directly by lascar.output.parse_results.
+    """
+    number_of_guesses, k = values.shape
+    summaries = np.zeros(
+        (number_of_guesses,),
+        dtype=[("peaks", np.double, (k,)), ("samples", np.intp, (k,)), ("rank", np.intp)],
+    )
+    summaries["peaks"] = values
+    summaries["samples"] = samples
+
+    scores = np.abs(values[:, 0]) if absolute else values[:, 0]
+    summaries["rank"][np.argsort(-scores, kind="stable")] = np.arange(1, number_of_guesses + 1)
+    return summaries
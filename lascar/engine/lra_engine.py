@@ -19,6 +19,7 @@
 """
 lra_engine.py
 """
+from collections import OrderedDict
 from itertools import combinations
 import numpy as np
 from math import comb
@@ -26,20 +27,89 @@ from math import comb
 from . import GuessEngine
 from . import PartitionerEngine
 
-def get_bit_coefficients(value, order):
+def get_bit_coefficients(value, order, size_target_value=8):
     # return value as a sequence of bit coefficients,
     # ie, considering the binary expression of value 
     # it will return every bit combination up to the given order
 
-    bits = [int(i) for i in "{:08b}".format(value)]
-    
-    # we always start with a constant 1
-    res = [1]
+    return get_bit_coefficients_matrix(np.array([value]), order, size_target_value)[0]
+
+
+def get_bit_coefficients_matrix(values, order, size_target_value=8):
+    """
+    Vectorized version of get_bit_coefficients: compute the bit coefficients of an array of values.
 
+    :param values: np.array of integers
+    :param order: the regression order
+    :param size_target_value: the number of bits of the values
+    :return: np.array of shape values.shape + (number of coefficients,)
+    """
+    values = np.asarray(values, dtype=np.int64)
+    # bits[..., i] is the i-th bit of the binary expression (most significant bit first)
+    shifts = np.arange(size_target_value - 1, -1, -1)
+    bits = (values[..., None] >> shifts) & 1
+
+    # we always start with a constant 1
+    res = [np.ones(values.shape, dtype=np.uint)]
     for o in range(order):
-        for i in combinations(bits,o+1):
-            res += [np.prod(i)]
-    return np.array(res,dtype=np.uint)
+        for i in combinations(range(size_target_value), o + 1):
+            res.append(np.prod(bits[..., list(i)], axis=-1).astype(np.uint))
+    return np.stack(res, axis=-1)
+
+
+# the projection bases of the last engines created (eg the same attack on several bytes), least recently used first
+_projection_cache = OrderedDict()
+_projection_cache_size = 4
+
+
+def get_projection_bases(selection_function, partition_range, guess_range, regression_order, size_target_value):
+    """
+    For each guess k, compute M[k], the matrix of the bit coefficients of selection_function(v, k) for v in
+    partition_range, and Q[k] an orthonormal basis of its columns space.
+
+    The results of the last _projection_cache_size calls are cached: they only depend on (selection_function,
+    partition_range, guess_range, regression_order, size_target_value).
+
+    :return: (M, Q), of shapes (guesses, partitions, coefficients)
+    :raise np.linalg.LinAlgError: if some M[k] is not of full column rank (eg fewer partitions than coefficients)
+    """
+    partition_range = np.asarray(partition_range)
+    guess_range = np.asarray(guess_range)
+    key = (
+        selection_function,
+        partition_range.tobytes(),
+        guess_range.tobytes(),
+        regression_order,
+        size_target_value,
+    )
+    if key in _projection_cache:
+        _projection_cache.move_to_end(key)
+        return _projection_cache[key]
+
+    try:
+        targets = np.asarray(selection_function(partition_range[None, :], guess_range[:, None]))
+        if targets.shape != (len(guess_range), len(partition_range)):
+            raise ValueError
+    except Exception:
+        targets = np.array(
+            [[selection_function(v, k) for v in partition_range] for k in guess_range]
+        )
+
+    M = get_bit_coefficients_matrix(targets, regression_order, size_target_value).astype(np.double)
+    # the regression is only defined when M[k]^T.M[k] is invertible
+    rank_deficient = np.flatnonzero(np.linalg.matrix_rank(M) < M.shape[2])
+    if len(rank_deficient):
+        raise np.linalg.LinAlgError(
+            "The prediction matrix of guess %s is not of full rank: %d coefficients to regress on %d partitions."
+            % (guess_range[rank_deficient[0]], M.shape[2], M.shape[1])
+        )
+    Q, _ = np.linalg.qr(M)
+
+    _projection_cache[key] = (M, Q)
+    while len(_projection_cache) > _projection_cache_size:
+        _projection_cache.popitem(last=False)
+    return M, Q
+
 
 class LraEngine(PartitionerEngine,GuessEngine):
     """
@@ -72,8 +142,8 @@ class LraEngine(PartitionerEngine,GuessEngine):
         :param regression_order: the regression order (by default =1)
         :param size_target_value: the number of bits of the target value, that we are regressing (by default = 8). 
         """
-        PartitionerEngine.__init__(self, name, partition_function, partition_range, 2)
-        GuessEngine.__init__(self, name, selection_function, guess_range, solution)
+        PartitionerEngine.__init__(self, partition_function, partition_range, 2, name=name)
+        GuessEngine.__init__(self, selection_function, guess_range, name=name, solution=solution, jit=False)
         self.logger.debug(
             'Creating LraEngine "%s" with %d partitions, %d guesses.'
             % (name, len(self._partition_range), len(guess_range))
@@ -88,33 +158,26 @@ class LraEngine(PartitionerEngine,GuessEngine):
         for i in range(regression_order+1):
             self._nb_of_coefs += comb(size_target_value,i)
 
-        # preprocess all prediction matrices
-        self.P = np.zeros((len(guess_range), self._nb_of_coefs, self._output_cardinality))
-        self.M = np.zeros((len(guess_range), self._output_cardinality, self._nb_of_coefs))
-        for k in guess_range:
-            for v in self._partition_range:
-                x = self._partition_range_to_index[v]
-                self.M[k][x]= get_bit_coefficients(selection_function(x,k),regression_order)
-            self.P[k] = np.linalg.inv(self.M[k].T @ self.M[k]) @ self.M[k].T
-        
-
-    def _finalize(self):
-        self.R = np.zeros(
-            (self._number_of_guesses,) + self._session.leakage_shape, np.double
+        # preprocess all prediction matrices M[k], and orthonormal bases Q[k] of their columns space
+        self.M, self.Q = get_projection_bases(
+            selection_function, self._partition_range, self._guess_range, regression_order, size_target_value
         )
 
+    def _finalize(self):
         # compute the total sum of squares, from  acc_x_by_partition[i,j,k] = sum( (leakages[k])**i | partition = j)
         u =  self._acc_x_by_partition[0].sum(axis=0)
         v =  self._acc_x_by_partition[1].sum(axis=0)
         self.SST = v - (u ** 2) / self._partition_count.sum()
         
         # compute the coalesced matrix of traces
-        self.L = np.array([self._acc_x_by_partition[0][i]/self._partition_count[i] for i in range(len(self._partition_range))])
-        
-        for k in range(self.P.shape[0]):
-            beta = self.P[k] @ self.L
-            epsilon = self.M[k] @ beta
-            SSR = np.sum((epsilon - self.L)**2,axis=0)
-            self.R[k] = 1 -(SSR/self.SST[None,:])
-        return np.nan_to_num(self.R)
+        count_shape = (self._partition_size,) + (1,) * len(self._session.leakage_shape)
+        self.L = self._acc_x_by_partition[0] / self._partition_count.reshape(count_shape)
+        L = self.L.reshape((self._partition_size, -1))
 
+        # SSR = ||L - M.beta||^2 = ||L||^2 - ||Q^T.L||^2 , for all the guesses at once
+        projections = np.matmul(self.Q.transpose(0, 2, 1), L)
+        SSR = np.sum(L ** 2, axis=0)[None, :] - np.einsum("gcs,gcs->gs", projections, projections)
+        self.R = (1 - SSR / self.SST.reshape(-1)[None, :]).reshape(
+            (self._number_of_guesses,) + self._session.leakage_shape
+        )
+        return np.nan_to_num(self.R)
@@ -0,0 +1,161 @@
+# This file is part of lascar
+#
+# lascar is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+#
+#
+# Copyright 2018 Manuel San Pedro, Victor Servant, Charles Guillemet, Ledger SAS - manuel.sanpedro@ledger.fr, victor.servant@ledger.fr, charles@ledger.fr
+
+"""
+mia_engine.py
+"""
+import numpy as np
+
+from . import GuessEngine
+from .chi2test_engine import get_bin_indexes
+
+
+class MiaEngine(GuessEngine):
+    """
+    MiaEngine is a GuessEngine used to perform Mutual Information Analysis.
+
+    (B. Gierlichs, L. Batina, P. Tuyls, and B. Preneel. Mutual Information Analysis.
+    In E. Oswald and P. Rohatgi, editors, Cryptographic Hardware and Embedded Systems – CHES 2008,
+    volume 5154 of Lecture Notes in Computer Science, pages 426–442. Springer, 2008.)
+
+    Given a selection_function on the values under a guess guess (emulating a leakage model, with outputs in
+    model_range), MiaEngine estimates, for each guess and each sample, the mutual information (in bits) between the
+    output of the selection_function and the leakages.
+
+    The leakages are binned with fixed bins (as in Chi2TestEngine), and the joint histograms
+    (guess, model class, sample, bin) are accumulated with one matrix product per batch between the one-hot
+    encodings of the model classes and of the bins. The products are tiled over the samples (and over the guesses if
+    needed), so that the one-hot encoding of the bins and the product stay within memory_budget bytes. The mutual
+    information is computed from the histograms by tiles of samples as well.
+    """
+
+    def __init__(
+        self,
+        selection_function,
+        guess_range,
+        model_range,
+        n_bins,
+        bin_range,
+        memory_budget=2 ** 26,
+        name=None,
+        solution=None,
+        jit=True,
+    ):
+        """
+
+        :param selection_function: takes a value and a guess_guess as input, returns an output within model_range.
+        :param guess_range: what are the values for the guess guess
+        :param model_range: possible outputs of the selection_function (or its number of outputs)
+        :param n_bins: number of bins for the leakage histograms
+        :param bin_range: (min, max) lower and upper bounds for the bins. Samples outside are counted in the edge bins.
+        :param memory_budget: maximum size (in bytes) of the temporaries of a tile: the one-hot encoding of the bins and its product with the model classes, and the probabilities of the tile in finalize()
+        :param solution: if known, indicate the correct guess guess.
+        """
+        if name is None:
+            name = "mia"
+        GuessEngine.__init__(self, selection_function, guess_range, solution=solution, name=name, jit=jit)
+
+        if isinstance(model_range, int):
+            model_range = range(model_range)
+        self._model_range = np.array(model_range, dtype=np.uint32)
+        self._model_size = len(self._model_range)
+        self._model_range_to_index = np.zeros((self._model_range.max() + 1,), dtype=np.intp)
+        self._model_range_to_index[self._model_range] = np.arange(self._model_size)
+
+        bin_width = (bin_range[1] - bin_range[0]) / n_bins
+        self._bin_starts = np.array([bin_range[0] + i * bin_width for i in range(n_bins)], dtype=np.double)
+        self._memory_budget = memory_budget
+
+        self.output_parser_mode = "max"
+        self.logger.debug(
+            'Creating MiaEngine "%s" with %d guesses, %d model classes, %d bins.'
+            % (name, len(guess_range), self._model_size, n_bins)
+        )
+
+    def _initialize(self):
+        number_of_samples = int(np.prod(self._session.leakage_shape))
+        # histogram[guess, model class, sample, bin] (counts)
+        self._histogram = np.zeros(
+            (self._number_of_guesses, self._model_size, number_of_samples, len(self._bin_starts)),
+            dtype=np.uint32,
+        )
+        self.size_in_memory += self._histogram.nbytes
+
+    def _update(self, batch):
+        n_bins = len(self._bin_starts)
+        number_of_samples = self._histogram.shape[2]
+
+        # one-hot encoding of the model classes: (batch, guess * model class)
+        m = self._model_range_to_index[np.asarray(self._mapfunction(self._guess_range, batch.values))]
+        models_one_hot = np.zeros((len(batch), self._number_of_guesses, self._model_size), np.double)
+        np.put_along_axis(models_one_hot, m[:, :, None], 1.0, axis=2)
+        models_one_hot = models_one_hot.reshape((len(batch), -1))
+
+        bins = get_bin_indexes(self._bin_starts, batch.leakages.reshape((len(batch), -1)))
+        rows = self._number_of_guesses * self._model_size
+        histogram = self._histogram.reshape((rows, number_of_samples, n_bins))
+
+        # a tile of samples needs 8 * n_bins bytes per sample, for each trace (bins_one_hot) and each row (product)
+        tile_size = max(1, self._memory_budget // (8 * n_bins * (len(batch) + rows)))
+        # with a single sample per tile, the rows may also have to be split
+        row_chunk_size = max(1, self._memory_budget // (8 * n_bins * tile_size) - len(batch))
+        for start in range(0, number_of_samples, tile_size):
+            stop = min(start + tile_size, number_of_samples)
+            # one-hot encoding of the bins: (batch, sample * bin)
+            bins_one_hot = np.zeros((len(batch), stop - start, n_bins), np.double)
+            np.put_along_axis(bins_one_hot, bins[:, start:stop, None], 1.0, axis=2)
+            bins_one_hot = bins_one_hot.reshape((len(batch), -1))
+            for row in range(0, rows, row_chunk_size):
+                chunk = slice(row, min(row + row_chunk_size, rows))
+                counts = models_one_hot[:, chunk].T @ bins_one_hot
+                histogram[chunk, start:stop] += counts.reshape((-1, stop - start, n_bins)).astype(np.uint32)
+
+    def _finalize(self):
+        """
+        I(L; M) = H(M) + H(L) - H(M, L), computed from the histograms, for all the guesses at once.
+        The probabilities are computed by tiles of samples, so that a tile and its temporaries (the logarithms
+        of the probabilities) stay within memory_budget bytes.
+        """
+        number_of_samples = self._histogram.shape[2]
+        # a sample needs 8 bytes per (guess, model class, bin), for the probabilities and 3 temporaries
+        tile_size = max(1, self._memory_budget // (32 * self._histogram[:, :, 0].size))
+
+        mutual_information = np.zeros((self._number_of_guesses, number_of_samples), np.double)
+        for start in range(0, number_of_samples, tile_size):
+            stop = min(start + tile_size, number_of_samples)
+            p_joint = self._histogram[:, :, start:stop] / self._number_of_processed_traces
+            p_model = p_joint.sum(3)
+            p_leakage = p_joint[0].sum(0)
+            mutual_information[:, start:stop] = (
+                _entropy(p_model, 1) + _entropy(p_leakage, 1)[None, :] - _entropy(p_joint, (1, 3))
+            )
+        return np.nan_to_num(mutual_information).reshape(
+            (self._number_of_guesses,) + self._session.leakage_shape
+        )
+
+    def _clean(self):
+        del self._histogram
+        self.size_in_memory = 0
+
+
+def _entropy(p, axis):
+    """
+    Entropy (in bits) of the probabilities p, along the given axis.
+    """
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return -np.where(p > 0, p * np.log2(p), 0.0).sum(axis)
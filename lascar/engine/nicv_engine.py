@@ -22,6 +22,7 @@ nicv_engine.py
 import numpy as np
 
 from . import PartitionerEngine
+from .snr_engine import MultiTargetSnrEngine
 
 
 class NicvEngine(PartitionerEngine):
@@ -36,16 +37,19 @@ class NicvEngine(PartitionerEngine):
         It needs a partition_function that will take trace values as an input and returns output within partition_range.
         """
 
-    def __init__(self, partition_function, partition_range, name=None, jit=True):
+    def __init__(self, partition_function, partition_range, name=None, jit=True, spill_directory=None):
         """
 
         :param name:
         :param partition_function: function that will take trace values as an input and returns output within partition_range.
         :param partition_range: possible values for the partitioning.
+        :param spill_directory: if set, the accumulators are stored as memmaps in this directory
         """
         if name is None:
             name = "nicv"
-        PartitionerEngine.__init__(self, partition_function, partition_range, 1, name=name, jit=jit)
+        PartitionerEngine.__init__(
+            self, partition_function, partition_range, 1, name=name, jit=jit, spill_directory=spill_directory
+        )
         self.logger.debug(
             'Creating NicvEngine "%s" with %d classes.'
             % (name, len(self._partition_range))
@@ -75,4 +79,27 @@ class NicvEngine(PartitionerEngine):
             ((acc / total_nb_of_traces) - (self._session["mean"].finalize()) ** 2)
             / self._session["var"].finalize(),
             False,
-        )
\ No newline at end of file
+        )
+
+
+class MultiTargetNicvEngine(MultiTargetSnrEngine):
+    """
+    MultiTargetNicvEngine computes at once the Normalized-Inter-Class-Variance of several targets, on Side-Channel
+    Traces (see MultiTargetSnrEngine for the vectorized partition_function).
+
+    The result is a (targets,) + leakage_shape array.
+    """
+
+    def __init__(self, partition_function, partition_range, name=None, jit=True):
+        if name is None:
+            name = "multi_target_nicv"
+        MultiTargetSnrEngine.__init__(self, partition_function, partition_range, name=name, jit=jit)
+
+    def _finalize(self):
+        """
+        NICV =  V[E[L|X]] / V[X], for all the targets (see NicvEngine)
+        """
+        return np.nan_to_num(
+            self._get_v_e_cond() / self._session["var"].finalize(),
+            False,
+        )
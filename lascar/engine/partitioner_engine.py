@@ -19,11 +19,84 @@
 """
 partitioner_engine.py
 """
+import os
+from concurrent.futures import ThreadPoolExecutor
+
 import numpy as np
 
 from .engine import Engine
 
 
+_sample_blocks_executor = None
+
+
+def _reset_sample_blocks_executor():
+    # the threads of the executor do not survive a fork: a forked process creates its own executor
+    global _sample_blocks_executor
+    _sample_blocks_executor = None
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_sample_blocks_executor)
+
+
+def run_by_sample_blocks(kernel, acc, leakages, *args, n_jobs=None, min_block_size=256):
+    """
+    Run kernel(acc[..., block], leakages[:, block], *args) on blocks of samples, in parallel threads.
+
+    The kernel must release the GIL (eg a numba function jitted with nogil=True), and must only write
+    in the block of acc it is given, so that the blocks can be processed concurrently.
+    (Numba parallel=True kernels are not used: depending on the threading layer, they can not be safely called from
+    the threads used by the Session.)
+
+    :param kernel: the function to run on each block of samples
+    :param acc: the accumulator, whose last axis is the samples axis
+    :param leakages: the leakages, of shape (batch, samples)
+    :param args: additional arguments for the kernel
+    :param n_jobs: number of blocks (by default, the number of cpus)
+    :param min_block_size: minimum number of samples by block (small blocks are not worth a thread)
+    """
+    global _sample_blocks_executor
+    number_of_samples = leakages.shape[1]
+    n_jobs = min(n_jobs or os.cpu_count() or 1, number_of_samples // min_block_size)
+    if n_jobs <= 1:
+        kernel(acc, leakages, *args)
+        return
+
+    if _sample_blocks_executor is None:
+        _sample_blocks_executor = ThreadPoolExecutor(os.cpu_count())
+
+    bounds = np.linspace(0, number_of_samples, n_jobs + 1).astype(int)
+    futures = [
+        _sample_blocks_executor.submit(kernel, acc[..., start:stop], leakages[:, start:stop], *args)
+        for start, stop in zip(bounds[:-1], bounds[1:])
+    ]
+    [future.result() for future in futures]
+
+
+try:
+    from numba import njit
+
+    @njit(nogil=True)
+    def _accumulate_by_partition(acc, leakages, partition_indexes):
+        """
+        acc[o, partition_indexes[i], s] += leakages[i, s] ** (o + 1), in place.
+        The leakages can have any numerical dtype: they are converted on the fly.
+        """
+        for i in range(leakages.shape[0]):
+            idx = partition_indexes[i]
+            for s in range(leakages.shape[1]):
+                x = np.float64(leakages[i, s])
+                p = x
+                acc[0, idx, s] += p
+                for o in range(1, acc.shape[0]):
+                    p *= x
+                    acc[o, idx, s] += p
+
+except Exception:
+    _accumulate_by_partition = None
+
+
 # class PartitionFunction:
 #     def __init__(self, func, size):
 #         self.function = func
@@ -52,9 +125,13 @@ class PartitionerEngine(Engine):
 
     partition_value = partition(value)
     0 <= partition_value < partition_size
+
+    For large partition ranges (eg 2^16 classes), the accumulators can be stored on disk (spill_directory), as a memmap:
+    the traces of each batch are then accumulated in the order of their partition, so that the accumulators are swept
+    sequentially, which suits the page cache.
     """
 
-    def __init__(self, partition_function, partition_range, order, name=None, jit=True):
+    def __init__(self, partition_function, partition_range, order, name=None, jit=True, spill_directory=None):
         """
         PartitionEngine
         :param name: the name chosen for the Engine
@@ -62,6 +139,7 @@ class PartitionerEngine(Engine):
         :param partition_function: a function (or callable) which will be applied to the trace values and return a positive integer
         :param partition_range: the possible partition_values
         :param order: the order needed by the engine ( order=1: sum of leakages, order=2: sum of square of leakages,...)
+        :param spill_directory: if set, the (order, partition, sample) accumulator is stored as a memmap in this directory
 
         """
 
@@ -77,6 +155,7 @@ class PartitionerEngine(Engine):
             self._partition_range_to_index[j] = i
 
         self._order = order
+        self._spill_directory = spill_directory
 
         self.jit = jit
         if jit:
@@ -87,58 +166,65 @@ class PartitionerEngine(Engine):
                     "Cannot jit without Numba. Please install Numba or consider turning off the jit option"
                 )
             self._partition_function = jit(nopython=True)(partition_function)
+
+            @jit(nopython=True)
+            def jitted_partition_indexes(batchvalues, pfunc=self._partition_function, rng2idx=self._partition_range_to_index):
+                out = np.zeros((batchvalues.shape[0],), dtype=np.uint32)
+                for pv in np.arange(batchvalues.shape[0]):
+                    out[pv] = rng2idx[pfunc(batchvalues[pv])]
+                return out
+
+            self._jitted_partition_indexes = jitted_partition_indexes
         else:
             self._partition_function = partition_function
         Engine.__init__(self, name)
 
+    def get_partition_indexes(self, batchvalues):
+        """
+        Compute, for each value of a batch, the index (within partition_range) of its partition value.
+
+        :param batchvalues: the values of a TraceBatch
+        :return: np.array of uint32, of length len(batchvalues)
+        """
+        if self.jit:
+            return self._jitted_partition_indexes(batchvalues)
+        return np.array(
+            [self._partition_range_to_index[self._partition_function(v)] for v in batchvalues],
+            dtype=np.uint32,
+        )
+
     def _initialize(self):
 
-        self._acc_x_by_partition = np.zeros(
-            (self._order, self._partition_size) + self._session.leakage_shape,
-            dtype=np.double,
+        self._acc_x_by_partition = self._allocate_accumulator(
+            (self._order, self._partition_size) + self._session.leakage_shape
         )
 
         # acc_x_by_partition[i,j,k] = sum( (leakages[k])**i | partition = j)
 
         self._partition_count = np.zeros((self._partition_size,), dtype=np.double)
 
-        self.size_in_memory += self._acc_x_by_partition.nbytes
         self.size_in_memory += self._partition_count.nbytes
-        if self.jit:
-            from numba import jit
 
-            @jit(nopython=True)
-            def jitted_update(batchvalues, batchleakages, pfunc = self._partition_function, psize = self._partition_size, rng2idx = self._partition_range_to_index, order = self._order):
-                pcount = np.zeros((psize,), dtype=np.uint32)
-                acc_x = np.zeros((order, psize, batchleakages.shape[1]), dtype=np.double)
-
-                for pv in np.arange(batchvalues.shape[0]):
-                    idx = rng2idx[pfunc(batchvalues[pv])]
-                    pcount[idx] += 1
-                    acc_x[0, idx] += batchleakages[pv]
-                    for o in range(1,order):
-                        acc_x[o, idx] += np.power(batchleakages[pv], o + 1)
-                
-                return pcount, acc_x
-
-            def new_update(batch):
-                pcount, acc_x = jitted_update(batch.values, batch.leakages)
-                self._partition_count += pcount
-                self._acc_x_by_partition += acc_x
-
-            self._update = new_update 
+    def _update(self, batch):
+        partition_indexes = self.get_partition_indexes(batch.values)
+        self._partition_count += np.bincount(partition_indexes, minlength=self._partition_size)
+
+        # the accumulators are updated in place, on the flattened leakages
+        acc = self._acc_x_by_partition.reshape((self._order, self._partition_size, -1))
+        leakages = batch.leakages.reshape((len(batch), -1))
+        if self._spill_directory is not None:
+            # the rows of the spilled accumulator are then visited in increasing order
+            order = np.argsort(partition_indexes, kind="stable")
+            leakages, partition_indexes = leakages[order], partition_indexes[order]
+        if _accumulate_by_partition is not None:
+            run_by_sample_blocks(_accumulate_by_partition, acc, leakages, partition_indexes)
         else:
-            self._update = self._base_update
-
-    def _base_update(self, batch):
-        partition_values = list(map(self._partition_function, batch.values))
-        for i, v in enumerate(partition_values):
-            idx = self._partition_range_to_index[v]
-            self._partition_count[idx] += 1
+            leakages = leakages.astype(np.double)
+            power = leakages
             for o in range(0, self._order):
-                self._acc_x_by_partition[
-                    o, idx
-                ] += np.power(batch.leakages[i], o + 1, dtype=np.double)
+                if o:
+                    power = power * leakages
+                np.add.at(acc[o], partition_indexes, power)
 
     def _finalize(self):
         pass
@@ -146,6 +232,7 @@ class PartitionerEngine(Engine):
     def _clean(self):
         del self._acc_x_by_partition
         del self._partition_count
+        self._remove_spilled_accumulators()
         self.size_in_memory = 0
 
     def get_mean_by_partition(self):
@@ -157,9 +244,6 @@ class PartitionerEngine(Engine):
         :return: np.array containing the means by partition.
         """
 
-        acc = np.zeros(self._acc_x_by_partition.shape[1:], np.double)
-        for v in self._partition_range:
-            i = self._partition_range_to_index[v]
-            acc[i] = self._acc_x_by_partition[0, i] / self._partition_count[i]
-
-        return acc
+        count_shape = (self._partition_size,) + (1,) * (self._acc_x_by_partition.ndim - 2)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            return self._acc_x_by_partition[0] / self._partition_count.reshape(count_shape)
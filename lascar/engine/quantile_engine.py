@@ -0,0 +1,145 @@
+# This file is part of lascar
+#
+# lascar is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+#
+#
+# Copyright 2018 Manuel San Pedro, Victor Servant, Charles Guillemet, Ledger SAS - manuel.sanpedro@ledger.fr, victor.servant@ledger.fr, charles@ledger.fr
+
+"""
+quantile_engine.py
+"""
+import numpy as np
+
+from . import Engine
+
+
+class QuantileEngine(Engine):
+    """
+    QuantileEngine is an Engine computing, in one pass, quantiles (median, percentiles, ...) of the leakages,
+    for each sample.
+
+    Each sample is summarized by a KLL sketch (Z. Karnin, K. Lang, E. Liberty. Optimal Quantile Approximation in
+    Streams. FOCS 2016), of bounded memory: the memory used does not depend on the number of traces.
+    The sketches of all the samples share the same structure, so that they are updated together, with vectorized
+    operations over the samples:
+        - a batch is appended to the level 0 compactor,
+        - a full compactor at level h is sorted and half of its items (the odd or even ones, at random) are
+          promoted to level h+1, where they weigh 2^(h+1).
+
+    Error: for a sketch of size k, the rank of the returned quantile differs from the exact rank by about
+    0.6/k * number_of_traces on average, and by less than 2/k * number_of_traces for 99% of the queries
+    (eg 1% of the traces for k=200). While fewer than k traces have been processed, the quantiles are exact
+    (smallest leakage whose cumulated frequency reaches q).
+
+    Sketches are mergeable (see merge()), eg to combine results computed on several containers.
+    """
+
+    def __init__(self, quantiles=(0.25, 0.5, 0.75), k=200, name=None, random_state=None):
+        """
+
+        :param quantiles: the quantiles (within [0, 1]) output by finalize(). Others can be queried with get_quantiles()
+        :param k: size of the sketch (the larger, the more accurate). The memory used is about 3k values per sample
+        :param name:
+        :param random_state: seed (or np.random.Generator) used for the compactions
+        """
+        if name is None:
+            name = "quantile"
+        Engine.__init__(self, name)
+        self.quantiles = quantiles
+        self.k = k
+        self._random_state = random_state
+        self.logger.debug('Creating QuantileEngine "%s" with k=%d.' % (name, k))
+
+    def _initialize(self):
+        self._number_of_samples = int(np.prod(self._session.leakage_shape))
+        # _levels[h]: the items of the level h compactor, for all the samples: shape (items, samples)
+        self._levels = []
+        self._rng = np.random.default_rng(self._random_state)
+
+    def _get_capacity(self, level):
+        return max(2, int(np.ceil(self.k * (2 / 3) ** (len(self._levels) - 1 - level))))
+
+    def _insert(self, level, items):
+        while len(self._levels) <= level:
+            self._levels.append(np.zeros((0, self._number_of_samples), np.double))
+        self._levels[level] = np.concatenate((self._levels[level], items))
+
+    def _compress(self):
+        level = 0
+        while level < len(self._levels):
+            if len(self._levels[level]) >= self._get_capacity(level):
+                self._compact(level)
+            level += 1
+        self.size_in_memory = sum(items.nbytes for items in self._levels)
+
+    def _compact(self, level):
+        items = self._levels[level]
+        # with an odd number of items, the last one stays at this level
+        m = len(items) - len(items) % 2
+        sorted_items = np.sort(items[:m], axis=0)
+        offsets = self._rng.integers(0, 2, size=self._number_of_samples)
+        promoted = np.take_along_axis(sorted_items, 2 * np.arange(m // 2)[:, None] + offsets[None, :], axis=0)
+
+        self._levels[level] = items[m:]
+        self._insert(level + 1, promoted)
+
+    def _update(self, batch):
+        self._insert(0, batch.leakages.reshape((len(batch), -1)).astype(np.double))
+        self._compress()
+
+    def merge(self, other):
+        """
+        Merge into this engine the sketches of another (initialized) QuantileEngine, on the same leakage_shape.
+
+        :param other: a QuantileEngine
+        """
+        for level, items in enumerate(other._levels):
+            self._insert(level, items)
+        self._number_of_processed_traces += other._number_of_processed_traces
+        self._compress()
+
+    def get_quantiles(self, quantiles):
+        """
+        Query the sketches.
+
+        :param quantiles: a quantile, or a list of quantiles, within [0, 1]
+        :return: np.array of shape leakage_shape (for a single quantile) or (len(quantiles),) + leakage_shape
+        """
+        q = np.atleast_1d(np.asarray(quantiles, dtype=np.double))
+
+        values = np.concatenate(self._levels)
+        weights = np.concatenate(
+            [np.full((len(items),), 2.0 ** level) for level, items in enumerate(self._levels)]
+        )
+        order = np.argsort(values, axis=0)
+        values = np.take_along_axis(values, order, axis=0)
+        cumulated_weights = np.cumsum(weights[order], axis=0)
+
+        results = np.zeros((len(q), values.shape[1]), np.double)
+        for i, quantile in enumerate(q):
+            # index of the first item whose cumulated weight reaches quantile * total weight
+            indexes = (cumulated_weights < quantile * cumulated_weights[-1]).sum(0)
+            indexes = np.minimum(indexes, len(values) - 1)
+            results[i] = np.take_along_axis(values, indexes[None], axis=0)[0]
+
+        if np.ndim(quantiles) == 0:
+            return results[0].reshape(self._session.leakage_shape)
+        return results.reshape((len(q),) + self._session.leakage_shape)
+
+    def _finalize(self):
+        return self.get_quantiles(self.quantiles)
+
+    def _clean(self):
+        del self._levels
+        self.size_in_memory = 0
@@ -0,0 +1,220 @@
+# This file is part of lascar
+#
+# lascar is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+#
+#
+# Copyright 2018 Manuel San Pedro, Victor Servant, Charles Guillemet, Ledger SAS - manuel.sanpedro@ledger.fr, victor.servant@ledger.fr, charles@ledger.fr
+
+"""
+sharded_engine.py
+"""
+import copy
+import mmap
+import multiprocessing
+import os
+
+import numpy as np
+
+from . import Engine
+from .engine import _EngineSession
+from .guess_engine import get_peak_summaries
+from lascar.container import TraceBatchContainer
+from lascar.output.parse_results import is_peak_summaries
+
+
+def _run_shard(engine, session, connection, buffer):
+    """
+    Main loop of a worker process: update/finalize the engine (a shard of the guess range) on request.
+    """
+    while True:
+        message = connection.recv()
+        try:
+            if message[0] == "initialize":
+                engine.initialize(session)
+                connection.send(None)
+
+            elif message[0] == "update":
+                _, leakages_spec, values_spec, payload = message
+                if payload is None:
+                    leakages = np.ndarray(leakages_spec[0], leakages_spec[1], buffer=buffer, offset=0)
+                    values = np.ndarray(values_spec[0], values_spec[1], buffer=buffer, offset=values_spec[2])
+                else:
+                    leakages, values = payload
+                batch = TraceBatchContainer(leakages, values)
+                session["mean"].update(batch)
+                session["var"].update(batch)
+                engine.update(batch)
+                connection.send(None)
+
+            elif message[0] == "finalize":
+                connection.send(
+                    (engine.finalize(), getattr(engine, "peak_samples", None), getattr(engine, "pruning_history", None))
+                )
+
+            elif message[0] == "stop":
+                # the spilled accumulators of the shard are removed before the process exits
+                if engine._number_of_processed_traces in engine.finalize_step:
+                    engine.clean()
+                engine._remove_spilled_accumulators()
+                connection.send(None)
+                return
+
+        except Exception as e:
+            connection.send(e)
+
+
+class ShardedGuessEngine(Engine):
+    """
+    ShardedGuessEngine distributes a GuessEngine (CpaEngine, DpaEngine, MatchEngine, ...) over several worker
+    processes, by splitting its guess range: each worker runs a copy of the engine on its own slice of guesses.
+
+    It is meant for engines whose cost is dominated by the number of guesses (eg 65536 guesses), where all the
+    cores can then work on one single attack. (Use it together with the guess chunking of the engines to bound
+    the memory used by each worker.)
+
+    Each batch is written once in a memory region shared with the workers (forked at initialize()), which all update
+    their shard concurrently.
+    At finalize(), the results of the shards are gathered along the guess axis, so that the results (and their
+    parsing by the OutputMethods) are the same as for the engine itself. The peak_samples and the pruning_history of
+    the shards are gathered as well. Note that with pruning, each shard prunes its guesses against the best guess of
+    its own shard. Any other state of the shards stays in the worker processes.
+
+    The worker processes are forked: this engine is not available on platforms without fork (Windows).
+    They are stopped by clean().
+    """
+
+    def __init__(self, engine, number_of_workers=None, name=None):
+        """
+
+        :param engine: the GuessEngine to be sharded (not registered to the Session)
+        :param number_of_workers: number of worker processes (by default, the number of cpus)
+        :param name: (by default, the name of the engine)
+        """
+        if name is None:
+            name = engine.name
+        Engine.__init__(self, name)
+        self.engine = engine
+        self.number_of_workers = min(number_of_workers or os.cpu_count() or 1, engine._number_of_guesses)
+
+        # the ShardedGuessEngine looks like the engine to the OutputMethods
+        self._guess_range = engine._guess_range
+        self._number_of_guesses = engine._number_of_guesses
+        self.solution = engine.solution
+        self.output_parser_mode = engine.output_parser_mode
+        self.peak_samples = None
+        self.pruning_history = []
+        self._workers = []
+        self._buffer = None
+
+        self.logger.debug(
+            'Creating ShardedGuessEngine "%s" with %d workers.' % (name, self.number_of_workers)
+        )
+
+    def _initialize(self):
+        self._stop_workers()
+        if self._buffer is not None:
+            self._buffer.close()
+        self.pruning_history = []
+
+        # the shared buffer can hold a whole batch (larger batches are sent through the pipes)
+        number_of_traces = min(self._session._batch_size, self._session.container.number_of_traces)
+        leakage_size = self._session.container._leakage_abstract.zeros().nbytes
+        value_size = self._session.container._value_abstract.zeros().nbytes
+        size = _align(number_of_traces * leakage_size) + number_of_traces * value_size
+        self._buffer = mmap.mmap(-1, max(size, 1))
+
+        context = multiprocessing.get_context("fork")
+        for shard in np.array_split(np.arange(self._number_of_guesses), self.number_of_workers):
+            engine = copy.copy(self.engine)
+            engine.name = "%s_shard_%d" % (self.engine.name, shard[0])
+            engine._guess_range = self.engine._guess_range[shard[0]: shard[-1] + 1]
+            engine._number_of_guesses = len(shard)
+            engine.solution = None
+            engine.result = {}
+            engine.finalize_step = []
+            engine.size_in_memory = 0
+
+            connection, worker_connection = context.Pipe()
+            process = context.Process(
+                target=_run_shard,
+                args=(engine, _EngineSession(self._session), worker_connection, self._buffer),
+                daemon=True,
+            )
+            process.start()
+            self._workers.append((process, connection))
+
+        # the shards allocate their accumulators in their own process
+        self._gather(("initialize",))
+
+    def _gather(self, command):
+        for _, connection in self._workers:
+            connection.send(command)
+        answers = [connection.recv() for _, connection in self._workers]
+        for answer in answers:
+            if isinstance(answer, Exception):
+                raise answer
+        return answers
+
+    def _update(self, batch):
+        leakages = np.ascontiguousarray(batch.leakages)
+        values = np.ascontiguousarray(batch.values)
+
+        leakages_spec = (leakages.shape, leakages.dtype)
+        values_spec = (values.shape, values.dtype, _align(leakages.nbytes))
+        if values_spec[2] + values.nbytes <= len(self._buffer):
+            np.ndarray(leakages.shape, leakages.dtype, buffer=self._buffer)[...] = leakages
+            np.ndarray(values.shape, values.dtype, buffer=self._buffer, offset=values_spec[2])[...] = values
+            payload = None
+        else:
+            payload = (leakages, values)
+
+        self._gather(("update", leakages_spec, values_spec, payload))
+
+    def _finalize(self):
+        answers = self._gather(("finalize",))
+        results = np.concatenate([answer[0] for answer in answers])
+        if answers[0][1] is not None:
+            self.peak_samples = np.concatenate([answer[1] for answer in answers])
+        if answers[0][2] is not None:
+            # (number of traces, pruned guesses) over all the shards
+            pruned = {}
+            for answer in answers:
+                for n, guesses in answer[2]:
+                    pruned.setdefault(n, []).extend(guesses)
+            self.pruning_history = sorted(pruned.items(), key=lambda item: item[0])
+
+        if is_peak_summaries(results):
+            # the ranks are computed over the whole guess range
+            results = get_peak_summaries(
+                results["peaks"], results["samples"], absolute=self.output_parser_mode == "argmax"
+            )
+        return results
+
+    def _stop_workers(self):
+        if self._workers:
+            self._gather(("stop",))
+            for process, connection in self._workers:
+                process.join()
+                connection.close()
+            self._workers = []
+
+    def _clean(self):
+        self._stop_workers()
+        self._buffer.close()
+        self._buffer = None
+        self.size_in_memory = 0
+
+
+def _align(number_of_bytes, alignment=64):
+    return -(-number_of_bytes // alignment) * alignment
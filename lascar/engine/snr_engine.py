@@ -22,8 +22,28 @@ snr_engine.py
 
 import numpy as np
 
+from . import Engine
 from . import PartitionerEngine
 
+from .partitioner_engine import run_by_sample_blocks
+
+try:
+    from numba import njit
+
+    @njit(nogil=True)
+    def _accumulate_by_targets(acc, leakages, partition_indexes):
+        """
+        acc[t, partition_indexes[i, t], s] += leakages[i, s]
+        """
+        for s in range(leakages.shape[1]):
+            for i in range(leakages.shape[0]):
+                x = leakages[i, s]
+                for t in range(partition_indexes.shape[1]):
+                    acc[t, partition_indexes[i, t], s] += x
+
+except Exception:
+    _accumulate_by_targets = None
+
 class SnrEngine(PartitionerEngine):
     """
     SnrEngine is a PartitionerEngine used to compute the Signal-to-Noise-Ratio on Side-Channel Traces.
@@ -35,15 +55,18 @@ class SnrEngine(PartitionerEngine):
     It needs a partition_function that will take trace values as an input and returns output within partition_range.
     """
 
-    def __init__(self, partition_function, partition_range, name=None, jit = True):
+    def __init__(self, partition_function, partition_range, name=None, jit=True, spill_directory=None):
         """
         :param name: 
         :param partition_function: function that will take trace values as an input and returns output within partition_range.
         :param partition_range: possible values for the partitioning.
+        :param spill_directory: if set, the accumulators are stored as memmaps in this directory
         """
         if name is None:
             name = "snr"
-        PartitionerEngine.__init__(self, partition_function, partition_range, 1, name=name, jit=jit)
+        PartitionerEngine.__init__(
+            self, partition_function, partition_range, 1, name=name, jit=jit, spill_directory=spill_directory
+        )
         self.logger.debug(
             'Creating SnrEngine  "%s" with %d classes.' % (name, len(partition_range))
         )
@@ -73,4 +96,101 @@ class SnrEngine(PartitionerEngine):
             1./(self._session["var"].finalize() / V_E_cond -1),
             False,
         )
-        
\ No newline at end of file
+
+
+class MultiTargetSnrEngine(Engine):
+    """
+    MultiTargetSnrEngine computes at once the Signal-to-Noise-Ratio of several targets (eg the 16 bytes of several
+    intermediate values), on Side-Channel Traces.
+
+    It needs a vectorized partition_function: it takes the values of a whole batch as an input, and returns a
+    (batch, targets) matrix of partition values, within partition_range.
+
+    The class sums of all the targets are accumulated with a single jitted kernel, run in parallel over blocks of
+    samples, and the result is a (targets,) + leakage_shape array.
+    """
+
+    def __init__(self, partition_function, partition_range, name=None, jit=True):
+        """
+        :param partition_function: vectorized function that takes the batch values and returns a (batch, targets) array of partition values.
+        :param partition_range: possible values for the partitioning (common to all the targets).
+        :param jit: use the jitted accumulation kernel (needs Numba)
+        """
+        if name is None:
+            name = "multi_target_snr"
+        Engine.__init__(self, name)
+
+        if isinstance(partition_range, int):
+            partition_range = range(partition_range)
+        self._partition_range = np.array(partition_range, dtype=np.uint32)
+        self._partition_size = len(self._partition_range)
+        self._partition_range_to_index = np.zeros((self._partition_range.max() + 1,), dtype=np.intp)
+        self._partition_range_to_index[self._partition_range] = np.arange(self._partition_size)
+
+        self._partition_function = partition_function
+
+        if jit and _accumulate_by_targets is None:
+            raise Exception(
+                "Cannot jit without Numba. Please install Numba or consider turning off the jit option"
+            )
+        self.jit = jit
+        self.logger.debug(
+            'Creating %s "%s" with %d classes.' % (type(self).__name__, name, self._partition_size)
+        )
+
+    def _initialize(self):
+        self._number_of_targets = np.asarray(
+            self._partition_function(self._session.container[0:1].values)
+        ).reshape((1, -1)).shape[1]
+
+        # acc_x_by_partition[t, j, k] = sum( leakages[k] | partition of target t = j)
+        self._acc_x_by_partition = np.zeros(
+            (self._number_of_targets, self._partition_size) + self._session.leakage_shape,
+            dtype=np.double,
+        )
+        self._partition_count = np.zeros((self._number_of_targets, self._partition_size), dtype=np.double)
+        self.size_in_memory += self._acc_x_by_partition.nbytes + self._partition_count.nbytes
+
+    def _get_partition_indexes(self, batch):
+        partition_values = np.asarray(self._partition_function(batch.values)).reshape((len(batch), -1))
+        return self._partition_range_to_index[partition_values]
+
+    def _update(self, batch):
+        partition_indexes = self._get_partition_indexes(batch)
+        leakages = batch.leakages.reshape((len(batch), -1))
+        acc = self._acc_x_by_partition.reshape((self._number_of_targets, self._partition_size, -1))
+
+        if self.jit:
+            run_by_sample_blocks(_accumulate_by_targets, acc, leakages, partition_indexes)
+        else:
+            for t in range(self._number_of_targets):
+                np.add.at(acc[t], partition_indexes[:, t], leakages)
+
+        flat_indexes = partition_indexes + np.arange(self._number_of_targets)[None, :] * self._partition_size
+        self._partition_count += np.bincount(
+            flat_indexes.reshape(-1), minlength=self._partition_count.size
+        ).reshape(self._partition_count.shape)
+
+    def _get_v_e_cond(self):
+        """
+        V[E[L|X]], for all the targets
+        """
+        count_shape = self._partition_count.shape + (1,) * len(self._session.leakage_shape)
+        count = self._partition_count.reshape(count_shape)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            acc = np.where(count > 0, self._acc_x_by_partition ** 2 / count, 0.0).sum(1)
+        return (acc / self._number_of_processed_traces) - (self._session["mean"].finalize()) ** 2
+
+    def _finalize(self):
+        """
+        SNR = V[E[L|X]] / E[V[L|X]], for all the targets (see SnrEngine)
+        """
+        return np.nan_to_num(
+            1. / (self._session["var"].finalize() / self._get_v_e_cond() - 1),
+            False,
+        )
+
+    def _clean(self):
+        del self._acc_x_by_partition
+        del self._partition_count
+        self.size_in_memory = 0
@@ -0,0 +1,148 @@
+# This file is part of lascar
+#
+# lascar is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+#
+#
+# Copyright 2018 Manuel San Pedro, Victor Servant, Charles Guillemet, Ledger SAS - manuel.sanpedro@ledger.fr, victor.servant@ledger.fr, charles@ledger.fr
+
+"""
+success_rate_engine.py
+"""
+import copy
+
+import numpy as np
+
+from . import CpaEngine
+from . import Engine
+from .engine import _EngineSession
+from .engine import _StackedMeanVar
+from lascar.container import TraceBatchContainer
+from lascar.output.parse_results import apply_parse
+
+
+class SuccessRateEngine(Engine):
+    """
+    SuccessRateEngine runs number_of_experiments independent attacks of a GuessEngine, in one single pass over the
+    traces, to estimate the success rate and the guessing entropy of the attack.
+
+    Each trace is assigned (at random) to one of the experiments, so that the experiments are run on disjoint sets of
+    traces, as with split_container(), but the container is read only once.
+
+    For a CpaEngine (without pruning nor spill_directory), the accumulators of all the experiments are stacked,
+    and updated at once: the model is computed once per batch, and the mean/var of all the experiments are
+    accumulated with one matrix product.
+    Any other engine is updated once per experiment, with the traces of the batch assigned to it.
+
+    The finalize() method outputs a np.array of shape (2,), containing:
+        - the success rate (of order order): the proportion of experiments where the rank of the solution is <= order,
+        - the guessing entropy: the average rank of the solution (1 is the best).
+    The ranks of the solution for each experiment are kept in ranks, and the curves along the output steps in
+    success_rates and guessing_entropies (the number of traces per experiment is about finalize_step / number_of_experiments).
+    """
+
+    def __init__(self, engine, number_of_experiments, order=1, name=None, random_state=None, vectorized=True):
+        """
+
+        :param engine: the GuessEngine to be evaluated (not registered to the Session). Its solution must be set.
+        :param number_of_experiments: number of independent experiments
+        :param order: order of the success rate
+        :param name:
+        :param random_state: seed (or np.random.Generator) used to assign the traces to the experiments
+        :param vectorized: if False, the experiments are always updated one after another
+        """
+        if engine.solution is None:
+            raise ValueError("SuccessRateEngine needs the solution of the engine to be set.")
+        if engine.solution not in list(engine._guess_range):
+            raise ValueError("The solution of the engine (%s) is not in its guess range." % (engine.solution,))
+        if name is None:
+            name = "success_rate_%s" % engine.name
+        Engine.__init__(self, name)
+        self.engine = engine
+        self.number_of_experiments = number_of_experiments
+        self.order = order
+        self._random_state = random_state
+        self._vectorized = vectorized and isinstance(engine, CpaEngine) and engine._can_be_stacked()
+        self.output_parser_mode = None
+
+        self.ranks = None
+        self.success_rates = []
+        self.guessing_entropies = []
+        self.logger.debug(
+            'Creating SuccessRateEngine "%s" with %d experiments.' % (name, number_of_experiments)
+        )
+
+    def _initialize(self):
+        self._rng = np.random.default_rng(self._random_state)
+        self.success_rates = []
+        self.guessing_entropies = []
+
+        self._experiments = []
+        for _ in range(self.number_of_experiments):
+            experiment = copy.copy(self.engine)
+            experiment.result = {}
+            experiment.finalize_step = []
+            experiment.size_in_memory = 0
+            experiment.initialize(_EngineSession(self._session))
+            self._experiments.append(experiment)
+
+        if self._vectorized:
+            # the accumulators of the experiments become views on stacked accumulators
+            self._mean_var = _StackedMeanVar([experiment._session for experiment in self._experiments])
+            self._stacked_accumulators = CpaEngine._stack_engines(self._experiments)
+
+        self.size_in_memory = sum(experiment.size_in_memory for experiment in self._experiments)
+
+    def _update(self, batch):
+        experiments = self._rng.integers(0, self.number_of_experiments, len(batch))
+        if self._vectorized:
+            self._update_vectorized(batch, experiments)
+        else:
+            for e, experiment in enumerate(self._experiments):
+                indexes = np.flatnonzero(experiments == e)
+                if not len(indexes):
+                    continue
+                sub_batch = TraceBatchContainer(batch.leakages[indexes], batch.values[indexes])
+                experiment._session["mean"].update(sub_batch)
+                experiment._session["var"].update(sub_batch)
+                experiment.update(sub_batch)
+
+    def _update_vectorized(self, batch, experiments):
+        # one_hot[e, i] = 1 if the trace i is assigned to the experiment e
+        one_hot = np.zeros((self.number_of_experiments, len(batch)), np.double)
+        one_hot[experiments, np.arange(len(batch))] = 1.0
+
+        self._mean_var.update(batch.leakages.reshape((len(batch), -1)).astype(np.double), one_hot)
+        CpaEngine._update_stacked(self._experiments, self._stacked_accumulators, batch, one_hot)
+
+    def _finalize(self):
+        solution = self.engine.solution
+        ranks = []
+        for experiment in self._experiments:
+            results = experiment.finalize()
+            ranks.append(next(rank for guess, _, rank in apply_parse(experiment, results) if guess == solution))
+        self.ranks = np.array(ranks)
+
+        success_rate = np.mean(self.ranks <= self.order)
+        guessing_entropy = np.mean(self.ranks)
+        self.success_rates.append(success_rate)
+        self.guessing_entropies.append(guessing_entropy)
+        return np.array([success_rate, guessing_entropy])
+
+    def _clean(self):
+        for experiment in self._experiments:
+            experiment.clean()
+        del self._experiments
+        if self._vectorized:
+            del self._mean_var, self._stacked_accumulators
+        self.size_in_memory = 0
@@ -0,0 +1,202 @@
+# This file is part of lascar
+#
+# lascar is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+#
+#
+# Copyright 2018 Manuel San Pedro, Victor Servant, Charles Guillemet, Ledger SAS - manuel.sanpedro@ledger.fr, victor.servant@ledger.fr, charles@ledger.fr
+
+"""
+template_engine.py
+"""
+import numpy as np
+
+from . import GuessEngine
+from . import PartitionerEngine
+
+
+class GaussianTemplates:
+    """
+    GaussianTemplates stores the result of a TemplateProfileEngine: the means of each class and a pooled covariance
+    matrix, over the points of interest.
+
+    The Cholesky factor of the covariance is precomputed, so that the log-likelihoods of a whole batch of leakages
+    for all the classes are computed with a single matrix product.
+    """
+
+    def __init__(self, means, covariance, partition_range, pois=None):
+        """
+        :param means: np.array of shape (number of classes, number of pois)
+        :param covariance: pooled covariance matrix, of shape (number of pois, number of pois)
+        :param partition_range: the class values
+        :param pois: the points of interest (indexes on the flattened leakages). If None, all the samples are used
+        """
+        self.means = means
+        self.covariance = covariance
+        self.partition_range = np.array(partition_range, dtype=np.uint32)
+        self.pois = pois
+
+        self._partition_range_to_index = np.zeros((self.partition_range.max() + 1,), dtype=np.intp)
+        self._partition_range_to_index[self.partition_range] = np.arange(len(self.partition_range))
+
+        # whitening: with covariance = C.C^T, the Mahalanobis distance is ||C^-1.(x - mean)||^2
+        cholesky = np.linalg.cholesky(covariance)
+        self._whitening = np.linalg.inv(cholesky).T
+        # the classes never seen during profiling get a null likelihood
+        self._empty_classes = np.isnan(means).any(1)
+        self._whitened_means = np.nan_to_num(means) @ self._whitening
+        self._whitened_means_norms = (self._whitened_means ** 2).sum(1)
+        self._log_constant = -np.log(np.diag(cholesky)).sum() - 0.5 * len(covariance) * np.log(2 * np.pi)
+
+    def log_likelihood(self, leakages):
+        """
+        Compute the log-likelihoods of a batch of leakages, for all the classes.
+
+        :param leakages: np.array of leakages, of shape (batch,) + leakage_shape
+        :return: np.array of shape (batch, number of classes)
+        """
+        x = leakages.reshape((len(leakages), -1))
+        if self.pois is not None:
+            x = x[:, self.pois]
+        x = x.astype(np.double) @ self._whitening
+
+        distances = (
+            (x ** 2).sum(1)[:, None]
+            - 2 * (x @ self._whitened_means.T)
+            + self._whitened_means_norms[None, :]
+        )
+        distances[:, self._empty_classes] = np.inf
+        return self._log_constant - 0.5 * distances
+
+
+class TemplateProfileEngine(PartitionerEngine):
+    """
+    TemplateProfileEngine is a PartitionerEngine used to build Gaussian templates, for template attacks.
+
+    (S. Chari, J. R. Rao, P. Rohatgi. Template Attacks. In B. S. Kaliski Jr., Ç. K. Koç, C. Paar, editors,
+    Cryptographic Hardware and Embedded Systems - CHES 2002, volume 2523 of Lecture Notes in Computer Science,
+    pages 13–28. Springer, 2002.)
+
+    In one streaming pass, it accumulates the sum of the leakages of each class (partition), and the
+    pooled covariance of the leakages over some points of interest.
+
+    The finalize() method outputs a GaussianTemplates, which can be used by TemplateMatchEngine.
+    """
+
+    def __init__(self, partition_function, partition_range, pois=None, name=None, jit=True):
+        """
+
+        :param partition_function: function that will take trace values as an input and returns output within partition_range.
+        :param partition_range: possible values for the partitioning.
+        :param pois: the points of interest (indexes on the flattened leakages). If None, all the samples are used
+        """
+        if name is None:
+            name = "template_profile"
+        PartitionerEngine.__init__(self, partition_function, partition_range, 1, name=name, jit=jit)
+        self.logger.debug(
+            'Creating TemplateProfileEngine "%s" with %d classes.' % (name, self._partition_size)
+        )
+        self._pois = None if pois is None else np.array(pois, dtype=np.intp)
+        self.output_parser_mode = None
+
+    def _initialize(self):
+        if self._pois is None:
+            number_of_pois = int(np.prod(self._session.leakage_shape))
+        else:
+            number_of_pois = len(self._pois)
+
+        # acc_x_by_partition[0, j] = sum( leakages[pois] - shift | partition = j)
+        self._acc_x_by_partition = np.zeros((1, self._partition_size, number_of_pois), dtype=np.double)
+        self._partition_count = np.zeros((self._partition_size,), dtype=np.double)
+        # acc_xx = sum( (leakages[pois] - shift)^T . (leakages[pois] - shift) )
+        self._acc_xx = np.zeros((number_of_pois, number_of_pois), dtype=np.double)
+
+        # the shift (the mean of the first batch) improves the numerical stability
+        self._shift = None
+
+        self.size_in_memory += (
+            self._acc_x_by_partition.nbytes + self._partition_count.nbytes + self._acc_xx.nbytes
+        )
+
+    def _update(self, batch):
+        x = batch.leakages.reshape((len(batch), -1))
+        if self._pois is not None:
+            x = x[:, self._pois]
+        x = x.astype(np.double)
+        if self._shift is None:
+            self._shift = x.mean(0)
+        y = x - self._shift
+
+        partition_indexes = self.get_partition_indexes(batch.values)
+        self._partition_count += np.bincount(partition_indexes, minlength=self._partition_size)
+        np.add.at(self._acc_x_by_partition[0], partition_indexes, y)
+        self._acc_xx += y.T @ y
+
+    def _finalize(self):
+        non_empty = self._partition_count > 0
+        count = self._partition_count[non_empty]
+
+        # pooled covariance: sum over classes of the scatter around the class mean, over (N - number of classes)
+        sums = self._acc_x_by_partition[0, non_empty]
+        scatter = self._acc_xx - (sums.T / count) @ sums
+        covariance = scatter / (self._number_of_processed_traces - len(count))
+
+        with np.errstate(divide="ignore", invalid="ignore"):
+            means = self._acc_x_by_partition[0] / self._partition_count[:, None] + self._shift
+
+        return GaussianTemplates(means, covariance, self._partition_range, self._pois)
+
+    def _clean(self):
+        del self._acc_xx
+        PartitionerEngine._clean(self)
+
+
+class TemplateMatchEngine(GuessEngine):
+    """
+    TemplateMatchEngine is a GuessEngine allowing to perform the matching phase of a template attack.
+
+    For each guess, it accumulates along the traces the log-likelihood given by the GaussianTemplates to the class
+    selection_function(value, guess).
+    The log-likelihoods of all the classes are computed once per batch, with a single matrix product.
+    """
+
+    def __init__(self, templates, selection_function, guess_range, name=None, solution=None, jit=True):
+        """
+
+        :param templates: GaussianTemplates (output of TemplateProfileEngine)
+        :param selection_function: takes a value and a guess_guess as input, returns the class under this guess.
+        :param guess_range: what are the values for the guess guess
+        :param solution: if known, indicate the correct guess guess.
+        :param jit: jit the selection_function (see GuessEngine)
+        """
+        if name is None:
+            name = "template_match"
+        GuessEngine.__init__(self, selection_function, guess_range, name=name, solution=solution, jit=jit)
+        self.templates = templates
+        self.output_parser_mode = "max"
+
+    def _initialize(self):
+        self._log_likelihoods = np.zeros((self._number_of_guesses,), np.double)
+
+    def _update(self, batch):
+        y = np.asarray(self._mapfunction(self._guess_range, batch.values), dtype=np.intp)
+        y = self.templates._partition_range_to_index[y]
+
+        log_likelihoods = self.templates.log_likelihood(batch.leakages)
+        self._log_likelihoods += np.take_along_axis(log_likelihoods, y, axis=1).sum(0)
+
+    def _finalize(self):
+        return self._log_likelihoods
+
+    def _clean(self):
+        del self._log_likelihoods
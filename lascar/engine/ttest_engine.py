@@ -36,17 +36,20 @@ class TTestEngine(PartitionerEngine):
 
     """
 
-    def __init__(self, partition_function, analysis_order=1, name=None):
+    def __init__(self, partition_function, analysis_order=1, name=None, all_orders=False):
         """
 
         :param name:
         :param partition_function: partition_function that will take trace values as an input and returns 0 or 1
+        :param analysis_order: the order of the t-test
+        :param all_orders: if True, the engine outputs the t-tests of all orders 1..analysis_order (stacked along the first axis)
         """
         if name is None:
             name = "t-test"
         PartitionerEngine.__init__(self, partition_function, range(2), 2, name=name)
         self.logger.debug('Creating TtestEngine  "%s". ' % (name))
         self._analysis_order = analysis_order
+        self._all_orders = all_orders
 
     def _initialize(self):
         super()._initialize()
@@ -60,7 +63,7 @@ class TTestEngine(PartitionerEngine):
                     (self._partition_size,) + self._session.leakage_shape,
                     dtype=np.double,
                     )
-
+            self.size_in_memory += self._central_sums.nbytes + self._estimated_means.nbytes
 
     def update(self, batch):
         """
@@ -69,55 +72,61 @@ class TTestEngine(PartitionerEngine):
         Formulas for Robust, One-Pass Parallel Computation of Covariances and Arbitrary-Order Statistical Moments,
         P. Pébay, 2008
         (https://www.osti.gov/servlets/purl/1028931)
+
+        The central sums of all the partitions are merged at once, from the highest order down to order 2, so that
+        the lower order sums needed by the merge formula are read before being updated (no copy needed).
         """
         super().update(batch)
 
         if self._analysis_order <= 1:
             return
 
-        indexes = [
-                np.where(np.apply_along_axis(self._partition_function, 1, batch.values) == val)[0]
-                for val in range(self._partition_size)
-                ]
+        max_order = 2 * self._analysis_order
+        leakages = batch.leakages.reshape((len(batch), -1))
+        central_sums = self._central_sums.reshape((max_order + 1, self._partition_size, -1))
+        estimated_means = self._estimated_means.reshape((self._partition_size, -1))
 
-        for idx in range(self._partition_size):
-            l = batch.leakages[indexes[idx]]
+        indexes = self.get_partition_indexes(batch.values)
+        one_hot = (indexes[:, None] == np.arange(self._partition_size)[None, :]).astype(np.double)
 
-            n = self._partition_count[idx]
-            n2 = len(l)
-            n1 = n - n2
+        n = self._partition_count[:, None]
+        n2 = one_hot.sum(0)[:, None]
+        n1 = n - n2
 
-            # Compute new estimated mean
-            m1 = self._estimated_means[idx]
-            m2 = l.mean(0)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            # Batch means, and new estimated means
+            m1 = estimated_means
+            m2 = (one_hot.T @ leakages) / n2
             delta = m2 - m1
-            self._estimated_means[idx] = m1 + n2 * (delta / n)
-
-            cs1 = np.copy(self._central_sums)
-            cs2 = np.zeros(
-                    (2 * self._analysis_order + 1,) + self._session.leakage_shape,
-                    dtype=np.double,
-                    )
-
-            # Update central sums
-            for o in range(2, 2 * self._analysis_order + 1):
-                cs2[o] = np.power(l - m2, o).sum(0)
-
-                # First batch
-                if n1 == 0:
-                    self._central_sums[o, idx] = cs2[o]
-                    continue
-
-                s = np.power(n1 * n2 * delta / n, o)
-                s *= ( np.power(1 / n2, o - 1)
-                        - np.power(-1 / n1, o - 1) )
+            updated = (n2 > 0)[:, 0]
+            first_batch = (n1 == 0)[:, 0]
+            estimated_means[updated] = (m1 + n2 * (delta / n))[updated]
+
+            # Batch central sums: cs2[o] = sum((l - m2) ** o | partition)
+            cs2 = np.zeros_like(central_sums)
+            deviations = leakages - m2[indexes]
+            power = deviations
+            for o in range(2, max_order + 1):
+                power = power * deviations
+                cs2[o] = one_hot.T @ power
+
+            # Merge, from the highest order down
+            r = n1 * n2 / n
+            for o in range(max_order, 1, -1):
+                s = np.power(r * delta, o)
+                s *= np.power(1 / n2, o - 1) - np.power(-1 / n1, o - 1)
+                delta_k = np.ones_like(delta)
                 for k in range(1, o - 1):
-                    tmp = np.power(delta, k) * comb(o, k)
-                    tmp *= ( np.power(-n2 / n, k) * cs1[o - k, idx]
-                            + np.power(n1 / n, k) * cs2[o - k] )
-                    s += tmp
+                    delta_k = delta_k * delta
+                    s += delta_k * comb(o, k) * (
+                        np.power(-n2 / n, k) * central_sums[o - k]
+                        + np.power(n1 / n, k) * cs2[o - k]
+                    )
 
-                self._central_sums[o, idx] += cs2[o] + s
+                merged = central_sums[o] + cs2[o] + s
+                central_sums[o] = np.where(
+                    first_batch[:, None], cs2[o], np.where(updated[:, None], merged, central_sums[o])
+                )
 
     def _finalize(self):
         """
@@ -127,66 +136,229 @@ class TTestEngine(PartitionerEngine):
         T. Schneider and A. Moradi, 2015
         (https://eprint.iacr.org/2015/207)
         """
+        if self._all_orders:
+            return np.array(
+                [self._compute_ttest(o) for o in range(1, self._analysis_order + 1)]
+            )
+        return self._compute_ttest(self._analysis_order)
+
+    def _compute_ttest(self, order):
+        """
+        Compute the t-test of a given order (1 <= order <= analysis_order) from the accumulators.
+        """
         n0 = self._partition_count[0]
         n1 = self._partition_count[1]
 
-        if self._analysis_order == 1:
+        if order == 1:
             m0 = self._acc_x_by_partition[0, 0] / n0
             m1 = self._acc_x_by_partition[0, 1] / n1
 
             v0 = (self._acc_x_by_partition[1, 0] / n0) - m0 ** 2
             v1 = (self._acc_x_by_partition[1, 1] / n1) - m1 ** 2
         else:
+            # Central moments
+            count_shape = (1, self._partition_size) + (1,) * len(self._session.leakage_shape)
+            central_moments = self._central_sums[: 2 * order + 1] / self._partition_count.reshape(count_shape)
 
-            #Central moments
-            central_moments = np.zeros(
-                    (2 * self._analysis_order + 1, self._partition_size) + self._session.leakage_shape,
-                    dtype=np.double,
-                    )
-            for o in range(2, 2 * self._analysis_order + 1):
-                for i in range(self._partition_size):
-                    central_moments[o, i] = self._central_sums[o, i] / self._partition_count[i]
+            if order == 2:
+                # Preprocessed traces are (l - m) ** 2
+                m0 = central_moments[2, 0]
+                m1 = central_moments[2, 1]
+                v = central_moments[4] - np.square(central_moments[2])
+            else:
+                # Preprocessed traces are ((l - m) / sd) ** order: use standardized moments
+                standard_deviations = np.sqrt(central_moments[2])
+                sm_order = central_moments[order] / np.power(standard_deviations, order)
+                sm_2order = central_moments[2 * order] / np.power(standard_deviations, 2 * order)
+                m0 = sm_order[0]
+                m1 = sm_order[1]
+                v = sm_2order - np.square(sm_order)
 
-            # Standardised moments
-            standardized_moments = np.zeros(
-                    (2 * self._analysis_order + 1, self._partition_size) + self._session.leakage_shape,
-                    dtype=np.double,
-                    )
+            v0 = v[0]
+            v1 = v[1]
 
-            if self._analysis_order > 2:
-                standard_deviations = np.sqrt(central_moments[2])
-                standardized_moments[2] = np.ones(standardized_moments[2].shape)
-                for o in range(3, 2 * self._analysis_order + 1):
-                    standardized_moments[o] = central_moments[o] / np.power(standard_deviations, o)
+        return np.nan_to_num(
+            (m0 - m1)
+            / np.sqrt((v0 / n0) + (v1 / n1)),
+            False,
+        )
 
+class BivariateTTestEngine(PartitionerEngine):
+    """
+    BivariateTTestEngine is a PartitionerEngine used to compute Welch's T-test at order 2 on pairs of samples.
 
+    For each pair of samples (i, j), the traces are virtually preprocessed into the centered product
+    (l[i] - E[l[i]]) * (l[j] - E[l[j]]) (the mean being taken within each partition),
+    and a Welch's T-test is computed on these products.
 
-            # Variance of preprocessed traces
-            variances = np.zeros(
-                    (2 * self._analysis_order + 1, self._partition_size) + self._session.leakage_shape,
-                    dtype=np.double,
-                    )
-            variances[1] = central_moments[2]
-            variances[2] = central_moments[4] - np.square(central_moments[2])
-            for i in range(3, self._analysis_order + 1):
-                variances[i] = standardized_moments[2 * i] - np.square(standardized_moments[i])
+    (Leakage Assessment Methodology – a clear roadmap for side-channel evaluations –,
+    T. Schneider and A. Moradi, 2015 (https://eprint.iacr.org/2015/207))
 
-            if self._analysis_order == 2:
-                m0 = central_moments[2, 0]
-                m1 = central_moments[2, 1]
-            else:
-                m0 = standardized_moments[self._analysis_order, 0]
-                m1 = standardized_moments[self._analysis_order, 1]
+    The product traces are never built: the engine accumulates, for each partition, the needed pair moments
+    sum(l[i]^a * l[j]^b) (a, b in {1, 2}) with blocked matrix products, tiled over the pair space so that the
+    temporaries stay within memory_budget bytes.
+
+    The pairs can be selected:
+        - with rois=(roi_0, roi_1): all pairs in roi_0 x roi_1. The result is indexed as result[i, j] for i in roi_0, j in roi_1.
+        - with window=w: all pairs (i, i + k) with 1 <= k <= w. The result is indexed as result[i, k - 1].
+        - with nothing: all pairs of samples, result[i, j].
 
-            v0 = variances[self._analysis_order, 0]
-            v1 = variances[self._analysis_order, 1]
+    It needs as input a partition_function that will take trace values as an input and returns 0 or 1
+    (2 partitions_values).
+    """
+
+    def __init__(self, partition_function, rois=None, window=None, memory_budget=2 ** 26, name=None, jit=True):
+        """
+
+        :param partition_function: partition_function that will take trace values as an input and returns 0 or 1
+        :param rois: optional, two lists of samples indexes: the pairs are roi_0 x roi_1
+        :param window: optional, only pairs of samples at distance <= window are considered (cannot be used with rois)
+        :param memory_budget: maximum size (in bytes) of the temporaries used by a tile of pair moments
+        """
+        if name is None:
+            name = "bivariate t-test"
+        if rois is not None and window is not None:
+            raise ValueError("BivariateTTestEngine: rois and window cannot be used together.")
+        PartitionerEngine.__init__(self, partition_function, range(2), 1, name=name, jit=jit)
+        self.logger.debug('Creating BivariateTTestEngine  "%s". ' % (name))
+        self._rois = rois
+        self._window = window
+        self._memory_budget = memory_budget
 
+    def _initialize(self):
+        number_of_samples = int(np.prod(self._session.leakage_shape))
+
+        if self._window is not None:
+            self._roi_0 = np.arange(number_of_samples)
+            self._roi_1 = None
+            shape = (number_of_samples, self._window)
+            # tile size t such that 4 blocks of t x (t + window) doubles fit within the budget
+            w = self._window
+            self._tile_size = int((-w + np.sqrt(w ** 2 + self._memory_budget / 8)) / 2)
+        else:
+            if self._rois is None:
+                self._roi_0 = self._roi_1 = np.arange(number_of_samples)
+            else:
+                self._roi_0, self._roi_1 = (np.array(roi, dtype=np.intp) for roi in self._rois)
+            shape = (len(self._roi_0), len(self._roi_1))
+            self._tile_size = self._memory_budget // (32 * len(self._roi_1))
+        self._tile_size = max(1, self._tile_size)
+
+        self._partition_count = np.zeros((self._partition_size,), dtype=np.double)
+
+        # acc_x[c, a - 1, i] = sum( y[i]^a | partition = c )
+        self._acc_x = np.zeros((self._partition_size, 2, number_of_samples), dtype=np.double)
+
+        # acc_pairs[c, 2 * (a - 1) + (b - 1), pair] = sum( y[i]^a * y[j]^b | partition = c )
+        self._acc_pairs = np.zeros((self._partition_size, 4) + shape, dtype=np.double)
+
+        # y = l - shift: the shift (the mean of the first batch) improves the numerical stability
+        self._shift = None
+
+        self.size_in_memory += self._acc_pairs.nbytes + self._acc_x.nbytes
+
+    def _update(self, batch):
+        leakages = batch.leakages.reshape((len(batch), -1)).astype(np.double)
+        if self._shift is None:
+            self._shift = leakages.mean(0)
+        y = leakages - self._shift
+
+        indexes = self.get_partition_indexes(batch.values)
+        for c in range(self._partition_size):
+            yc = y[indexes == c]
+            if not len(yc):
+                continue
+            self._partition_count[c] += len(yc)
+            yc2 = yc * yc
+            self._acc_x[c, 0] += yc.sum(0)
+            self._acc_x[c, 1] += yc2.sum(0)
+
+            if self._window is not None:
+                self._update_band(self._acc_pairs[c], yc, yc2)
+            else:
+                self._update_rois(self._acc_pairs[c], yc, yc2)
+
+    def _update_rois(self, acc, y, y2):
+        y_1, y2_1 = y[:, self._roi_1], y2[:, self._roi_1]
+        for start in range(0, len(self._roi_0), self._tile_size):
+            tile = slice(start, start + self._tile_size)
+            y_0, y2_0 = y[:, self._roi_0[tile]].T, y2[:, self._roi_0[tile]].T
+            acc[0, tile] += y_0 @ y_1
+            acc[1, tile] += y_0 @ y2_1
+            acc[2, tile] += y2_0 @ y_1
+            acc[3, tile] += y2_0 @ y2_1
+
+    def _update_band(self, acc, y, y2):
+        number_of_samples = y.shape[1]
+        w = self._window
+        # zero padding: the pairs beyond the last sample accumulate zeros
+        y_pad = np.concatenate((y, np.zeros((len(y), w), np.double)), 1)
+        y2_pad = np.concatenate((y2, np.zeros((len(y), w), np.double)), 1)
+        for start in range(0, number_of_samples, self._tile_size):
+            stop = min(start + self._tile_size, number_of_samples)
+            t = stop - start
+            rows = np.arange(t)[:, None]
+            cols = rows + np.arange(w)[None, :]
+
+            y_0, y2_0 = y[:, start:stop].T, y2[:, start:stop].T
+            y_1, y2_1 = y_pad[:, start + 1 : stop + w], y2_pad[:, start + 1 : stop + w]
+            acc[0, start:stop] += (y_0 @ y_1)[rows, cols]
+            acc[1, start:stop] += (y_0 @ y2_1)[rows, cols]
+            acc[2, start:stop] += (y2_0 @ y_1)[rows, cols]
+            acc[3, start:stop] += (y2_0 @ y2_1)[rows, cols]
+
+    def _get_pair_moments(self, c):
+        """
+        For the partition c, returns the means and variances of the centered products, over the pairs.
+        """
+        n = self._partition_count[c]
+        e_x, e_x2 = self._acc_x[c] / n
+        e_11, e_12, e_21, e_22 = self._acc_pairs[c] / n
+
+        if self._window is not None:
+            number_of_samples = len(e_x)
+            index_1 = np.arange(number_of_samples)[:, None] + np.arange(1, self._window + 1)[None, :]
+            valid = index_1 < number_of_samples
+            index_1 = np.minimum(index_1, number_of_samples - 1)
+            a, a2 = e_x[:, None], e_x2[:, None]
+            b, b2 = e_x[index_1], e_x2[index_1]
+        else:
+            valid = True
+            a, a2 = e_x[self._roi_0][:, None], e_x2[self._roi_0][:, None]
+            b, b2 = e_x[self._roi_1][None, :], e_x2[self._roi_1][None, :]
+
+        # E[(y[i] - a)(y[j] - b)]
+        mean = e_11 - a * b
+        # E[(y[i] - a)^2 (y[j] - b)^2]
+        e_squared = (
+            e_22
+            - 2 * b * e_21
+            - 2 * a * e_12
+            + 4 * a * b * e_11
+            + b ** 2 * a2
+            + a ** 2 * b2
+            - 3 * a ** 2 * b ** 2
+        )
+        return np.where(valid, mean, 0.0), np.where(valid, e_squared - mean ** 2, 0.0)
+
+    def _finalize(self):
+        n0 = self._partition_count[0]
+        n1 = self._partition_count[1]
+        m0, v0 = self._get_pair_moments(0)
+        m1, v1 = self._get_pair_moments(1)
         return np.nan_to_num(
             (m0 - m1)
             / np.sqrt((v0 / n0) + (v1 / n1)),
             False,
         )
 
+    def _clean(self):
+        del self._acc_pairs
+        del self._acc_x
+        del self._partition_count
+        self.size_in_memory = 0
+
+
 def compute_ttest(*containers, batch_size=100):
     """
     Compute Welch's TTest from distinct containers: no need of partitioning function, since each container contain only one of each criterion
@@ -77,6 +77,9 @@ def parse_output_max(results, guesses):
     :return: the parsed results
 
     """
+    if is_peak_summaries(results):
+        return parse_peak_summaries(results, guesses)
+
     if len(results.shape) == 2:
         scores = results.max(1)
     else:
@@ -103,11 +106,41 @@ def parse_output_argmax(results, guesses):
 
     """
 
-    if len(results.shape) == 2:
-        scores = np.abs(results).max(1)
+    if is_peak_summaries(results):
+        return parse_peak_summaries(results, guesses, absolute=True)
+
+    if len(results.shape) >= 2:
+        scores = np.abs(results).reshape(len(results), -1).max(1)
     else:
         scores = np.abs(results)
 
     tmp = sorted(zip(guesses, scores), key=lambda x: x[1], reverse=True)
     tmp2 = [(s[0], s[1], rank + 1) for rank, s in enumerate(tmp)]
     return sorted(tmp2, key=lambda x: x[0])
+
+
+def is_peak_summaries(results):
+    """
+    Tell whether results are peak summaries (see lascar.engine.guess_engine.get_peak_summaries)
+    """
+    return isinstance(results, np.ndarray) and results.dtype.names is not None and "rank" in results.dtype.names
+
+
+def parse_peak_summaries(results, guesses, absolute=False):
+    """
+    parse_peak_summaries is used on GuessEngines outputing peak summaries instead of their whole results.
+    The scores are the highest peaks, and the ranks are read directly from the summaries.
+
+    For each guess, it outputs: (i,j,k) where:
+    - i is the guess value
+    - j is the highest peak for guess i (in absolute value if absolute)
+    - k is the rank of the guess i among all guesses
+
+    :param results: the peak summaries to be parsed
+    :param guesses: the engines guesses
+    :return: the parsed results
+    """
+    scores = results["peaks"][:, 0]
+    if absolute:
+        scores = np.abs(scores)
+    return [(guess, score, rank) for guess, score, rank in zip(guesses, scores, results["rank"])]
@@ -22,6 +22,7 @@ import matplotlib.pyplot as plt
 
 from . import OutputMethod
 from .parse_results import apply_parse
+from .parse_results import is_peak_summaries
 from .rank_estimation import RankEstimation
 
 import numpy as np
@@ -100,6 +101,9 @@ class MatPlotLibOutputMethod(OutputMethod):
             plt.subplot(self.number_of_rows, self.number_of_columns, idx)
             plt.title(engine.name)
 
+        if is_peak_summaries(results):
+            results = results["peaks"][:, 0]
+
         if isinstance(results, np.ndarray) and len(results.shape) == 1:
             if not self.solution_only:
                 plt.plot(results, label=engine.name)
@@ -355,7 +359,9 @@ class FullRankProgressionOutputMethod(ScoreProgressionOutputMethod):
     def _update(self, engine, results):
 
         #right now it assumes that engine is of type 'argmax'
-        if len(results.shape) == 3:
+        if is_peak_summaries(results):
+            scores = np.abs(results["peaks"][..., 0])
+        elif len(results.shape) == 3:
             scores = np.abs(results).max(2)
         else:
             scores = np.abs(results)
@@ -264,7 +264,8 @@ class Session:
                 self.logger.debug("Computing results (output step %d)." % offsets[1])
                 for engine in self.engines.values():
                     results = engine.finalize()
-                    if isinstance(results, np.ndarray):
+                    # (memmap results are written to a new file at each finalize, and are not copied in memory)
+                    if isinstance(results, np.ndarray) and not isinstance(results, np.memmap):
                         results = np.copy(results)
                     self.output_method.update(engine, results)
 
@@ -198,6 +198,78 @@ class ReshapeProcessing(Processing):
         return leakage.reshape(self.shape)
 
 
+class SpectrumProcessing(Processing):
+    """
+    SpectrumProcessing is a processing turning leakages into their magnitude (or power) spectra, so that
+    CpaEngine, SnrEngine, TTestEngine, ... run in the frequency domain: their results are indexed by frequency bin.
+
+    The leakages can be cut into (possibly overlapping) segments of segment_length samples, each multiplied by a
+    window. The spectra of the segments are either averaged (Welch's method), or kept (the leakages then become
+    spectrograms, of shape (number of segments, number of frequency bins)).
+
+    Containers apply it once per batch (see process_batch()), with a single batched np.fft.rfft.
+    """
+
+    def __init__(
+        self,
+        window=None,
+        segment_length=None,
+        segment_step=None,
+        output="magnitude",
+        average_segments=True,
+        filename=None,
+    ):
+        """
+        :param window: None, the name of a numpy window ("hanning", "hamming", "blackman", "bartlett"),
+            or an array of length segment_length
+        :param segment_length: number of samples of the segments. If None, the whole leakage is used
+        :param segment_step: number of samples between the beginning of two segments (default: segment_length)
+        :param output: "magnitude" or "power"
+        :param average_segments: if True the spectra of the segments are averaged, otherwise they are all kept
+        """
+        if output not in ["magnitude", "power"]:
+            raise ValueError('output must be "magnitude" or "power".')
+        self.window = window
+        self.segment_length = segment_length
+        self.segment_step = segment_step if segment_step is not None else segment_length
+        self.output = output
+        self.average_segments = average_segments
+        Processing.__init__(self, filename)
+
+    def _get_window(self, length):
+        if self.window is None:
+            return None
+        if isinstance(self.window, str):
+            return getattr(np, self.window)(length)
+        return np.asarray(self.window, dtype=np.double)
+
+    def __call__(self, leakage):
+        return self.process_batch(leakage[None])[0]
+
+    def process_batch(self, leakages):
+        """
+        Compute the spectra of a whole batch of leakages, of shape (batch, samples).
+        """
+        leakages = np.asarray(leakages, dtype=np.double)
+        if self.segment_length is None:
+            segments = leakages[:, None]
+        else:
+            segments = np.lib.stride_tricks.sliding_window_view(leakages, self.segment_length, axis=1)
+            segments = segments[:, :: self.segment_step]
+
+        window = self._get_window(segments.shape[-1])
+        if window is not None:
+            segments = segments * window
+
+        spectra = np.abs(np.fft.rfft(segments, axis=-1))
+        if self.output == "power":
+            spectra **= 2
+
+        if self.average_segments:
+            return spectra.mean(1)
+        return spectra
+
+
 class CascadedProcessing(Processing):
     def __init__(self, *processings, filename=None):
         self.processings = processings
@@ -2,6 +2,7 @@ import pytest
 
 from lascar import *
 from lascar.tools.aes import sbox
+from lascar.output.parse_results import apply_parse
 import tempfile
 
 leakages = np.random.rand(300, 20)
@@ -67,6 +68,211 @@ functions_ttest = [
 ]
 
 
+class TestNonRegressionCovariance:
+    @pytest.mark.parametrize(
+        "container, output, dtype, block_size",
+        [
+            (c, o, d, b)
+            for c in containers
+            for o in ["covariance", "correlation"]
+            for d in [np.double, np.float32]
+            for b in [1024, 7]
+        ],
+    )
+    def test_covariance_engine(self, container, output, dtype, block_size, tmp_path):
+        session = Session(container)
+        engine = CovarianceEngine(
+            output=output, dtype=dtype, block_size=block_size, spill_directory=str(tmp_path) if block_size == 7 else None
+        )
+        session.add_engine(engine)
+        session.run(batch_size=50)
+
+        leakages = container[:].leakages
+        if output == "covariance":
+            expected = np.cov(leakages, rowvar=False, bias=True)
+        else:
+            expected = np.nan_to_num(np.corrcoef(leakages, rowvar=False))
+        tolerance = 1e-8 if dtype == np.double else 1e-4
+        assert np.allclose(engine.finalize(), expected, atol=tolerance)
+
+    def test_covariance_engine_spilled_results(self, tmp_path):
+        container = containers[0]
+        engine = CovarianceEngine(block_size=7, spill_directory=str(tmp_path))
+        steps = []
+
+        class SpilledOutputMethod(OutputMethod):
+            def _update(self, engine, results):
+                steps.append(results)
+
+        output_method = SpilledOutputMethod(engine)
+        session = Session(container, engines=[engine], output_method=output_method, output_steps=[100, 200])
+        session.run(batch_size=50)
+
+        leakages = container[:].leakages
+        for n, results in zip([100, 200], steps):
+            # passed as is by the Session, and not overwritten by the next finalize()
+            assert isinstance(results, np.memmap)
+            assert np.allclose(results, np.cov(leakages[:n], rowvar=False, bias=True))
+        engine.clean()
+        assert not any(tmp_path.iterdir())
+
+
+class TestNonRegressionQuantile:
+    @pytest.mark.parametrize("container", containers)
+    def test_quantile_engine_exact(self, container):
+        session = Session(container)
+        engine = QuantileEngine(quantiles=[0, 0.1, 0.5, 0.9, 1], k=1000)
+        session.add_engine(engine)
+        session.run(batch_size=50)
+
+        expected = np.quantile(container[:].leakages, [0, 0.1, 0.5, 0.9, 1], axis=0, method="inverted_cdf")
+        assert np.all(engine.finalize() == expected)
+
+    def test_quantile_engine_sketch(self):
+        leakages = np.random.randn(5000, 20)
+        container = TraceBatchContainer(leakages, np.zeros((5000, 1), np.uint8))
+        quantiles = np.linspace(0.05, 0.95, 19)
+
+        session = Session(container)
+        engines = [QuantileEngine(quantiles, k=100, name="q%d" % i, random_state=i) for i in range(2)]
+        session.add_engines(engines)
+        session.run(batch_size=250)
+
+        engines[0].merge(engines[1])
+        for engine, number_of_traces in zip(engines, [10000, 5000]):
+            assert engine._number_of_processed_traces == number_of_traces
+            assert sum(len(items) for items in engine._levels) < 3 * 100 + 250
+            ranks = (leakages[None] <= engine.finalize()[:, None]).mean(1)
+            assert np.abs(ranks - quantiles[:, None]).max() < 4 / 100
+
+
+class TestNonRegressionBootstrap:
+    @pytest.mark.parametrize("container", containers)
+    def test_bootstrap_engine_snr(self, container):
+        partition = lambda value: value[0] % 4
+        engines = [
+            BootstrapEngine(SnrEngine(partition, range(4), name="snr%d" % i), 20, random_state=0, vectorized=i)
+            for i in range(2)
+        ]
+        session = Session(container, engines=engines + [SnrEngine(partition, range(4), name="snr")])
+        session.run(batch_size=50)
+
+        generic, vectorized = [engine.finalize() for engine in engines]
+        assert np.allclose(vectorized[0], session["snr"].finalize())
+        assert np.allclose(generic, vectorized)
+        assert np.allclose(engines[0].replicates_results, engines[1].replicates_results)
+        assert np.all(vectorized[1] <= vectorized[2])
+
+    def test_bootstrap_engine_cpa(self):
+        guess_function, guess_range = guess_functions[0]
+        engine = BootstrapEngine(CpaEngine(guess_function, guess_range), 10, confidence=0.9, random_state=1)
+        session = Session(containers[0], engines=[engine, CpaEngine(guess_function, guess_range, name="cpa_ref")])
+        session.run(batch_size=50)
+
+        results = engine.finalize()
+        assert results.shape == (3, len(guess_range), leakages.shape[1])
+        assert np.allclose(results[0], session["cpa_ref"].finalize())
+        assert np.all(results[1] <= results[2])
+        assert engine.replicates_results.shape == (10, len(guess_range), leakages.shape[1])
+
+    def test_bootstrap_engine_ttest(self, tmp_path):
+        container = BasicAesSimulationContainer(500, 1, value_section="plaintext", seed=1)
+        engine = BootstrapEngine(TTestEngine(lambda value: value[0] & 1, analysis_order=2), 20, random_state=0)
+        engine_snr = BootstrapEngine(
+            SnrEngine(lambda value: value[0] & 3, range(4), spill_directory=str(tmp_path)), 5, random_state=0
+        )
+        session = Session(
+            container, engines=[engine, engine_snr, TTestEngine(lambda value: value[0] & 1, 2, name="ttest_ref")]
+        )
+        session.run(batch_size=50)
+
+        # the central sums of the order 2 t-test are not held in the partition accumulators
+        assert not engine._vectorized and engine_snr._vectorized
+        results = engine.finalize()
+        assert np.allclose(results[0], session["ttest_ref"].finalize())
+        assert np.all(results[1] <= results[2]) and np.any(results[1] < results[2])
+
+        engine_snr.finalize()
+        engine_snr.clean()
+        assert not any(tmp_path.iterdir())
+
+    def test_bootstrap_engine_spilled(self, tmp_path):
+        partition = lambda value: value[0] % 4
+        engines = [
+            BootstrapEngine(
+                SnrEngine(partition, range(4), name="snr%d" % i, spill_directory=str(tmp_path) if i else None),
+                10, random_state=0,
+            )
+            for i in range(2)
+        ]
+        session = Session(containers[0], engines=engines)
+        session.run(batch_size=50)
+
+        # the stacked accumulator of the replicates is spilled, as the accumulators of the wrapped engine
+        stacked = engines[1]._acc_x_by_partition
+        assert isinstance(stacked, np.memmap) and stacked.filename.startswith(str(tmp_path))
+        assert engines[1].size_in_memory < engines[0].size_in_memory - stacked.nbytes / 2
+        assert np.allclose(engines[0].finalize(), engines[1].finalize())
+
+        for engine in engines:
+            engine.clean()
+        assert not any(tmp_path.iterdir())
+
+
+class TestNonRegressionSuccessRate:
+    def test_success_rate_engine_cpa(self):
+        container = BasicAesSimulationContainer(2000, 1, value_section="plaintext", seed=1)
+        guess_function = lambda value, guess: hamming(sbox[value[3] ^ guess])
+        solution = container.key[3]
+        engines = [
+            SuccessRateEngine(
+                CpaEngine(guess_function, range(256), solution=solution), 8, name="sr%d" % i, random_state=0,
+                vectorized=i,
+            )
+            for i in range(2)
+        ]
+        engine_single = SuccessRateEngine(CpaEngine(guess_function, range(256), solution=solution), 1, name="sr")
+        output_method = DictOutputMethod(*engines)
+        session = Session(
+            container, engines=engines + [engine_single, CpaEngine(guess_function, range(256), name="cpa")],
+            output_method=output_method, output_steps=range(400, 2001, 400),
+        )
+        session.run(batch_size=100)
+
+        generic, vectorized = [engine.finalize() for engine in engines]
+        assert np.allclose(generic, vectorized)
+        assert np.all(engines[0].ranks == engines[1].ranks)
+        assert len(engines[1].success_rates) == 6
+        assert 0 <= vectorized[0] <= 1 and 1 <= vectorized[1] <= 256
+        assert vectorized[0] == np.mean(engines[1].ranks == 1)
+        assert engines[1].guessing_entropies[-1] <= engines[1].guessing_entropies[0]
+
+        parsed = apply_parse(session["cpa"], session["cpa"].finalize())
+        assert engine_single.finalize()[1] == [rank for guess, _, rank in parsed if guess == solution][0]
+
+    def test_success_rate_engine_dpa(self):
+        container = BasicAesSimulationContainer(500, 1, value_section="plaintext", seed=1)
+        guess_function = lambda value, guess: hamming(sbox[value[3] ^ guess]) > 4
+        engine = SuccessRateEngine(
+            DpaEngine(guess_function, range(256), solution=container.key[3]), 4, order=10, random_state=0
+        )
+        session = Session(container, engines=[engine])
+        session.run(batch_size=100)
+
+        results = engine.finalize()
+        assert engine.ranks.shape == (4,)
+        assert results[0] == np.mean(engine.ranks <= 10)
+        assert results[1] == np.mean(engine.ranks)
+
+    def test_success_rate_engine_needs_solution(self):
+        guess_function, guess_range = guess_functions[0]
+        with pytest.raises(ValueError):
+            SuccessRateEngine(CpaEngine(guess_function, guess_range), 4)
+        with pytest.raises(ValueError):
+            SuccessRateEngine(CpaEngine(guess_function, guess_range, solution=max(guess_range) + 1), 4)
+        SuccessRateEngine(CpaEngine(guess_function, guess_range, solution=guess_range[-1]), 4)
+
+
 class TestNonRegressionPartitionerEngine:
     @pytest.mark.parametrize(
         "container,partition,partition_range",
@@ -101,6 +307,23 @@ class TestNonRegressionPartitionerEngine:
 
         assert np.all(np.isclose(snr_numpy, engine.finalize()))
 
+    @pytest.mark.parametrize("container", containers)
+    def test_spilled_partitioner_engines(self, container, tmp_path):
+        partition, partition_range = lambda value: 3 + (value[-1] % 10), range(3, 13)
+        engines = [SnrEngine(partition, partition_range), NicvEngine(partition, partition_range)]
+        engines_spilled = [
+            SnrEngine(partition, partition_range, name="snr_spilled", spill_directory=str(tmp_path)),
+            NicvEngine(partition, partition_range, name="nicv_spilled", spill_directory=str(tmp_path)),
+        ]
+        session = Session(container, engines=engines + engines_spilled)
+        session.run(batch_size=50)
+
+        for engine, engine_spilled in zip(engines, engines_spilled):
+            assert isinstance(engine_spilled._acc_x_by_partition, np.memmap)
+            assert np.allclose(engine_spilled.finalize(), engine.finalize())
+            engine_spilled.clean()
+        assert not any(tmp_path.iterdir())
+
     @pytest.mark.parametrize(
         "container,partition,partition_range",
         [(c, f[0], f[1]) for c in containers for f in functions],
@@ -208,6 +431,152 @@ class TestNonRegressionPartitionerEngine:
 
             assert np.all(np.isclose(ttest_numpy, engine.finalize()))
 
+    @pytest.mark.parametrize(
+        "container,partition", [(c, functions_ttest[0][0]) for c in containers]
+    )
+    def test_ttest_all_orders_engine(self, container, partition):
+        d = 4
+        engines = [TTestEngine(partition, analysis_order=o, name="t%d" % o) for o in range(1, d + 1)]
+        engine_all_orders = TTestEngine(partition, analysis_order=d, all_orders=True)
+        session = Session(container, engines=engines + [engine_all_orders])
+        session.run(batch_size=70)
+
+        results = engine_all_orders.finalize()
+        assert results.shape == (d,) + session.leakage_shape
+        for o, engine in enumerate(engines):
+            assert np.all(np.isclose(results[o], engine.finalize()))
+
+    @pytest.mark.parametrize(
+        "container,partition,rois,window",
+        [
+            (c, functions_ttest[0][0], r, w)
+            for c in containers
+            for r, w in [(None, None), ([[0, 2, 5], [1, 3, 4, 7]], None), (None, 3)]
+        ],
+    )
+    def test_bivariate_ttest_engine(self, container, partition, rois, window):
+        session = Session(container)
+        engine = BivariateTTestEngine(partition, rois=rois, window=window, memory_budget=2000)
+        session.add_engine(engine)
+        session.run(batch_size=70)
+
+        container_bis = container[:]
+        classes = np.apply_along_axis(partition, 1, container_bis.values)
+        number_of_samples = container_bis.leakages.shape[1]
+
+        if window is not None:
+            pairs = [[(i, i + k) for k in range(1, window + 1)] for i in range(number_of_samples)]
+        elif rois is not None:
+            pairs = [[(i, j) for j in rois[1]] for i in rois[0]]
+        else:
+            pairs = [[(i, j) for j in range(number_of_samples)] for i in range(number_of_samples)]
+
+        ttest_numpy = np.zeros((len(pairs), len(pairs[0])))
+        for c in range(2):
+            l = container_bis.leakages[classes == c]
+            l = l - l.mean(0)
+            for u, row in enumerate(pairs):
+                for v, (i, j) in enumerate(row):
+                    if j >= number_of_samples:
+                        continue
+                    p = l[:, i] * l[:, j]
+                    sign = 1 if c == 0 else -1
+                    ttest_numpy[u, v] += sign * p.mean()
+
+        variances = np.zeros((2,) + ttest_numpy.shape)
+        for c in range(2):
+            l = container_bis.leakages[classes == c]
+            l = l - l.mean(0)
+            for u, row in enumerate(pairs):
+                for v, (i, j) in enumerate(row):
+                    if j < number_of_samples:
+                        variances[c, u, v] = (l[:, i] * l[:, j]).var() / len(l)
+        ttest_numpy = np.nan_to_num(ttest_numpy / np.sqrt(variances.sum(0)))
+
+        assert np.all(np.isclose(ttest_numpy, engine.finalize()))
+
+    @pytest.mark.parametrize(
+        "container,partition", [(c, f[0]) for c in containers for f in functions_ttest]
+    )
+    def test_chi2test_engine(self, container, partition, tmp_path):
+        from scipy.stats import chi2_contingency
+
+        container_bis = container[:]
+        bin_range = (container_bis.leakages.min(), container_bis.leakages.max())
+        n_bins = 5
+
+        session = Session(container)
+        engine = Chi2TestEngine("chi2", partition, n_bins, bin_range)
+        engine_spilled = Chi2TestEngine(
+            "chi2_spilled", partition, n_bins, bin_range, spill_directory=str(tmp_path), block_memory=1
+        )
+        session.add_engines([engine, engine_spilled])
+        session.run()
+
+        classes = np.apply_along_axis(partition, 1, container_bis.values)
+        bin_width = (bin_range[1] - bin_range[0]) / n_bins
+        bins = np.clip(
+            ((container_bis.leakages - bin_range[0]) // bin_width).astype(int), 0, n_bins - 1
+        )
+
+        chi2_numpy = np.zeros(container_bis.leakages.shape[1])
+        for j in range(len(chi2_numpy)):
+            table = np.array(
+                [np.bincount(bins[classes == c, j], minlength=n_bins) for c in range(2)]
+            )
+            _, chi2_numpy[j], _, _ = chi2_contingency(table[:, table.sum(0) > 0])
+
+        assert np.all(np.isclose(chi2_numpy, engine.finalize()))
+        assert np.allclose(engine_spilled.finalize(), engine.finalize())
+        engine_spilled.clean()
+        assert not any(tmp_path.iterdir())
+
+
+    @pytest.mark.parametrize(
+        "container,jitv", [(c, True) for c in containers] + [(containers[0], False)]
+    )
+    def test_multi_target_snr_nicv_engines(self, container, jitv):
+        partition = lambda values: np.stack([values[:, 0] % 4, 3 + (values[:, -1] % 10)], 1)
+        references = [
+            (lambda value: value[0] % 4, range(4)),
+            (lambda value: 3 + (value[-1] % 10), range(3, 13)),
+        ]
+
+        snr = MultiTargetSnrEngine(partition, range(13), jit=jitv)
+        nicv = MultiTargetNicvEngine(partition, range(13), jit=jitv)
+        snr_references = [SnrEngine(f, r, name="snr%d" % i) for i, (f, r) in enumerate(references)]
+        nicv_references = [NicvEngine(f, r, name="nicv%d" % i) for i, (f, r) in enumerate(references)]
+        session = Session(container, engines=[snr, nicv] + snr_references + nicv_references)
+        session.run(batch_size=70)
+
+        assert snr.finalize().shape == (2,) + session.leakage_shape
+        for t in range(2):
+            assert np.all(np.isclose(snr.finalize()[t], snr_references[t].finalize()))
+            assert np.all(np.isclose(nicv.finalize()[t], nicv_references[t].finalize()))
+
+
+    @pytest.mark.parametrize(
+        "dtype, leakage_shape, jitv",
+        [(d, s, j) for d in [np.int8, np.int16, np.float32] for s in [(600,), (20, 30)] for j in [True, False]],
+    )
+    def test_partitioner_engine_dtypes_and_shapes(self, dtype, leakage_shape, jitv):
+        leakages = np.random.randint(-100, 100, (300,) + leakage_shape).astype(dtype)
+        container = TraceBatchContainer(leakages, values)
+        partition = lambda value: value[0] % 4
+
+        session = Session(container)
+        engine = PartitionerEngine(partition, range(4), 3, jit=jitv)
+        session.add_engine(engine)
+        session.run(batch_size=70)
+
+        classes = values[:, 0] % 4
+        for o in range(3):
+            for c in range(4):
+                expected = np.power(leakages[classes == c].astype(np.double), o + 1).sum(0)
+                assert np.all(np.isclose(engine._acc_x_by_partition[o, c], expected))
+        assert np.all(engine._partition_count == np.bincount(classes, minlength=4))
+
+
 functions = [
     lambda value: hamming(value[0]),
     lambda value: hamming_weight(value[-1]),
@@ -261,6 +630,186 @@ class TestNonRegressionCpa:
             np.isclose(engine.finalize(), cpa_np)
         ), "cpa non_regression test not passed."
 
+    def test_cpa_engine_spectrum(self):
+        guess_function, guess_range = guess_functions[0]
+        spectrum_container = TraceBatchContainer(leakages, values)
+        spectrum_container.leakage_processing = SpectrumProcessing("hanning", 8, 4)
+        spectra_container = TraceBatchContainer(spectrum_container[:].leakages, values)
+
+        engines = []
+        for c in [spectrum_container, spectra_container]:
+            session = Session(c, engines=[CpaEngine(guess_function, guess_range)])
+            session.run(batch_size=50)
+            engines.append(session["cpa"])
+
+        assert engines[0].finalize().shape == (len(guess_range), 5)
+        assert np.allclose(engines[0].finalize(), engines[1].finalize())
+
+    @pytest.mark.parametrize(
+        "container, guess_function, guess_range, jitv",
+        [(containers[0], f[0], f[1], j) for f in guess_functions for j in [True, False]],
+    )
+    def test_cpa_engine_guess_chunks(self, container, guess_function, guess_range, jitv, tmp_path):
+        session = Session(container)
+        engine = CpaEngine(guess_function, guess_range, name="cpa", jit=jitv)
+        engine_chunked = CpaEngine(
+            guess_function, guess_range, name="cpa_chunked", jit=jitv, memory_budget=1, spill_directory=str(tmp_path)
+        )
+        engine_summary = CpaEngine(
+            guess_function, guess_range, name="cpa_summary", jit=jitv, memory_budget=50000, summary=True
+        )
+        session.add_engines([engine, engine_chunked, engine_summary])
+        session.run(batch_size=50)
+
+        results = engine.finalize()
+        assert np.all(np.isclose(engine_chunked.finalize(), results))
+        assert np.all(np.isclose(engine_summary.finalize(), np.abs(results).max(1)))
+        assert np.all(engine_summary.peak_samples == np.abs(results).argmax(1))
+
+        engine_chunked.clean()
+        assert not any(tmp_path.iterdir())
+
+    @pytest.mark.parametrize("jitv", [True, False])
+    def test_cpa_engine_top_k(self, jitv):
+        guess_function, guess_range = guess_functions[0]
+        session = Session(containers[0])
+        engine = CpaEngine(guess_function, guess_range, name="cpa", jit=jitv)
+        engine_top_k = CpaEngine(guess_function, guess_range, name="cpa_top_k", jit=jitv, top_k=3, memory_budget=1)
+        session.add_engines([engine, engine_top_k])
+        session.run(batch_size=50)
+
+        results = engine.finalize()
+        summaries = engine_top_k.finalize()
+        expected_samples = np.argsort(-np.abs(results), axis=1, kind="stable")[:, :3]
+        assert np.all(summaries["samples"] == expected_samples)
+        assert np.all(np.isclose(summaries["peaks"], np.take_along_axis(results, expected_samples, 1)))
+
+        parsed, parsed_top_k = apply_parse(engine, results), apply_parse(engine_top_k, summaries)
+        assert [r[2] for r in parsed] == [r[2] for r in parsed_top_k]
+        assert np.all(np.isclose([r[1] for r in parsed], [r[1] for r in parsed_top_k]))
+
+    @pytest.mark.parametrize("jitv", [True, False])
+    def test_cpa_engine_fused_peaks(self, jitv):
+        guess_function, guess_range = guess_functions[0]
+        engine = CpaEngine(guess_function, guess_range, name="cpa", jit=jitv)
+        engine_summary = CpaEngine(guess_function, guess_range, name="cpa_summary", jit=jitv, summary=True)
+        engine_top_1 = CpaEngine(guess_function, guess_range, name="cpa_top_1", jit=jitv, top_k=1)
+        output_method = DictOutputMethod("cpa", "cpa_summary", "cpa_top_1")
+        session = Session(
+            containers[0], engines=[engine, engine_summary, engine_top_1], output_method=output_method,
+            output_steps=[100, 200, 300],
+        )
+        session.run(batch_size=50)
+
+        for n in [100, 200, 300]:
+            results = np.abs(output_method.results["cpa"][n])
+            summaries = output_method.results["cpa_top_1"][n]
+            assert np.all(np.isclose(output_method.results["cpa_summary"][n], results.max(1)))
+            assert np.all(np.isclose(np.abs(summaries["peaks"][:, 0]), results.max(1)))
+            assert np.all(summaries["samples"][:, 0] == results.argmax(1))
+            assert [r[2] for r in apply_parse(engine, results)] == [r[2] for r in apply_parse(engine_top_1, summaries)]
+
+    @pytest.mark.parametrize("jitv", [True, False])
+    def test_cpa_engine_pruning(self, jitv):
+        container = BasicAesSimulationContainer(2000, 1, value_section="plaintext", seed=1)
+        guess_function = lambda value, guess: hamming(sbox[value[3] ^ guess])
+        solution = container.key[3]
+
+        engine = CpaEngine(guess_function, range(256), name="cpa", jit=jitv, solution=solution)
+        engine_pruned = CpaEngine(
+            guess_function, range(256), name="cpa_pruned", jit=jitv, solution=solution,
+            pruning_confidence=0.99, memory_budget=5000,
+        )
+        output_method = DictOutputMethod("cpa")
+        session = Session(
+            container, engines=[engine, engine_pruned], output_method=output_method,
+            output_steps=range(100, 2001, 100),
+        )
+        session.run(batch_size=50)
+
+        frozen = {}
+        for n, guesses in engine_pruned.pruning_history:
+            frozen.update({g: output_method.results["cpa"][n][g] for g in guesses})
+        results, results_pruned = engine.finalize(), engine_pruned.finalize()
+        assert 0 < len(frozen) <= 255
+        assert solution not in frozen
+        for guess in range(256):
+            expected = frozen[guess] if guess in frozen else results[guess]
+            assert np.all(np.isclose(results_pruned[guess], expected))
+
+    @pytest.mark.parametrize("container, jitv", [(c, j) for c in containers for j in [True, False]])
+    def test_cpa_engine_sharded(self, container, jitv):
+        guess_function, guess_range = guess_functions[0]
+        engine = CpaEngine(guess_function, guess_range, name="cpa", jit=jitv)
+        engine_sharded = ShardedGuessEngine(
+            CpaEngine(guess_function, guess_range, name="cpa_sharded", jit=jitv), number_of_workers=3
+        )
+        engine_top_k = ShardedGuessEngine(
+            CpaEngine(guess_function, guess_range, name="cpa_top_k", jit=jitv, top_k=2), number_of_workers=3
+        )
+        session = Session(container, engines=[engine, engine_sharded, engine_top_k])
+        session.run(batch_size=70)
+
+        results = engine.finalize()
+        assert np.allclose(engine_sharded.finalize(), results)
+        ranks = [r[2] for r in apply_parse(engine, results)]
+        assert [r[2] for r in apply_parse(engine_sharded, engine_sharded.finalize())] == ranks
+        assert [r[2] for r in apply_parse(engine_top_k, engine_top_k.finalize())] == ranks
+        engine_sharded.clean()
+        engine_top_k.clean()
+        assert not engine_sharded._workers
+
+    def test_cpa_engine_sharded_state(self, tmp_path):
+        container = BasicAesSimulationContainer(1000, 1, value_section="plaintext", seed=1)
+        guess_function = lambda value, guess: hamming(sbox[value[3] ^ guess])
+        shards = np.array_split(np.arange(256), 3)
+
+        engine_sharded = ShardedGuessEngine(
+            CpaEngine(guess_function, range(256), pruning_confidence=0.99, spill_directory=str(tmp_path)),
+            number_of_workers=3,
+        )
+        engines = [
+            CpaEngine(guess_function, shard, name="cpa%d" % i, pruning_confidence=0.99)
+            for i, shard in enumerate(shards)
+        ]
+        session = Session(container, engines=engines + [engine_sharded], output_steps=range(200, 1001, 200))
+        session.run(batch_size=50)
+
+        # the pruning of each shard is gathered
+        pruned = {}
+        for engine in engines:
+            for n, guesses in engine.pruning_history:
+                pruned.setdefault(n, set()).update(int(g) for g in guesses)
+        assert pruned
+        assert {n: set(int(g) for g in guesses) for n, guesses in engine_sharded.pruning_history} == pruned
+
+        # the shards remove their spilled accumulators when they are stopped
+        assert any(tmp_path.iterdir())
+        engine_sharded.clean()
+        assert not any(tmp_path.iterdir())
+
+    @pytest.mark.parametrize("container, thread_on_update", [(c, t) for c in containers for t in [True, False]])
+    def test_grouped_cpa_engines(self, container, thread_on_update):
+        def get_engines(suffix):
+            return [
+                CpaEngine(guess_functions[0][0], range(4), name="cpa0%s" % suffix),
+                CpaEngine(lambda value, guess: hamming(sbox[value[-1] ^ guess]), range(4), name="cpa1%s" % suffix),
+                CpaEngine(guess_functions[0][0], range(4), name="cpa_chunked%s" % suffix, memory_budget=1),
+                CpaEngine(lambda value, guess: value[1] ^ guess, range(4), name="cpa2%s" % suffix, jit=False),
+                DpaEngine(lambda value, guess: (value[0] ^ guess) & 1, range(4), name="dpa%s" % suffix),
+            ]
+
+        engines = get_engines("")
+        grouped = GroupedEngines("grouped", *get_engines("_grouped"))
+        session = Session(container, engines=engines + [grouped])
+        session.run(batch_size=50, thread_on_update=thread_on_update)
+
+        assert [e.name for e in grouped._fused_engines] == ["cpa0_grouped", "cpa1_grouped", "cpa2_grouped"]
+        for engine, grouped_engine in zip(engines, grouped.engines):
+            assert grouped_engine._number_of_processed_traces == engine._number_of_processed_traces
+            assert np.allclose(grouped_engine.finalize(), engine.finalize())
+        assert len(grouped.finalize()) == len(engines)
+
     @pytest.mark.parametrize(
         "container, partition, partition_size, guess_function, guess_range, leakage_model",
         [
@@ -308,3 +857,377 @@ class TestNonRegressionCpa:
         assert np.all(
             np.isclose(engine.finalize(), cpa_np)
         ), "cpa non_regression test not passed."
+
+    @pytest.mark.parametrize(
+        "container, partition, guess_function, guess_range",
+        [
+            (c, p, f[0], f[1])
+            for c in containers
+            for p in functions
+            for f in guess_functions_for_partition
+        ],
+    )
+    def test_model_bank_cpa_engine(
+        self, container, partition, guess_function, guess_range
+    ):
+
+        session = Session(container)
+        engine = ModelBankCpaEngine(
+            partition, range(256), guess_function, guess_range, leakage_models
+        )
+        session.add_engine(engine)
+        session.run()
+
+        container_bis = container[:]
+
+        cpa_np = np.zeros(
+            (len(guess_range), len(leakage_models), container_bis.leakages.shape[1])
+        )
+
+        for i, guess in enumerate(guess_range):
+            for k, leakage_model in enumerate(leakage_models):
+                model = np.array(
+                    [
+                        leakage_model(guess_function(partition(d), guess))
+                        for d in container_bis.values
+                    ]
+                )
+                cpa_np[i, k] = np.array(
+                    [
+                        np.corrcoef(model, container_bis.leakages[:, j])[0, 1]
+                        for j in range(cpa_np.shape[2])
+                    ]
+                )
+
+        assert np.all(
+            np.isclose(engine.finalize(), cpa_np)
+        ), "model bank cpa non_regression test not passed."
+
+    def test_model_bank_cpa_engine_models(self):
+        intermediate = np.arange(12).reshape((3, 4))
+        scalar_model = lambda value: 1.0 if value > 5 else 0.0
+        assert np.all(ModelBankCpaEngine._apply_model(scalar_model, intermediate) == (intermediate > 5))
+
+        # the errors of the model itself are not hidden by the fallback
+        def failing_model(value):
+            raise KeyError(value)
+
+        with pytest.raises(KeyError):
+            ModelBankCpaEngine._apply_model(failing_model, intermediate)
+
+
+dpa_guess_functions = [
+    (lambda value, guess: (value[0] ^ guess) & 1, range(4)),
+    (lambda value, guess: sbox[value[-1] ^ guess] >> 7, range(4, 14)),
+]
+
+
+class TestNonRegressionDpa:
+    @pytest.mark.parametrize(
+        "container,guess_function, guess_range, jitv",
+        [
+            (c, f[0], f[1], j)
+            for c in containers
+            for f in dpa_guess_functions
+            for j in [True, False]
+        ],
+    )
+    def test_dpa_engine(self, container, guess_function, guess_range, jitv):
+
+        session = Session(container)
+        engine = DpaEngine(guess_function, guess_range, jit=jitv)
+        session.add_engine(engine)
+        session.run()
+
+        container_bis = container[:]
+        dpa_np = np.zeros((len(guess_range), container_bis.leakages.shape[1]))
+
+        for i, guess in enumerate(guess_range):
+            y = np.array([guess_function(d, guess) for d in container_bis.values])
+            dpa_np[i] = (
+                container_bis.leakages[y == 1].mean(0)
+                - container_bis.leakages[y == 0].mean(0)
+            ) ** 2
+
+        assert np.all(
+            np.isclose(engine.finalize(), dpa_np)
+        ), "dpa non_regression test not passed."
+
+    @pytest.mark.parametrize("jitv", [True, False])
+    def test_dpa_engine_guess_chunks(self, jitv, tmp_path):
+        guess_function, guess_range = dpa_guess_functions[0]
+        session = Session(containers[0])
+        engine = DpaEngine(guess_function, guess_range, name="dpa", jit=jitv)
+        engine_chunked = DpaEngine(
+            guess_function, guess_range, name="dpa_chunked", jit=jitv, memory_budget=1, spill_directory=str(tmp_path)
+        )
+        engine_summary = DpaEngine(guess_function, guess_range, name="dpa_summary", jit=jitv, summary=True)
+        session.add_engines([engine, engine_chunked, engine_summary])
+        session.run(batch_size=50)
+
+        results = engine.finalize()
+        assert np.all(np.isclose(engine_chunked.finalize(), results))
+        assert np.all(np.isclose(engine_summary.finalize(), results.max(1)))
+        assert np.all(engine_summary.peak_samples == results.argmax(1))
+
+
+class TestNonRegressionSecondOrderCpa:
+    @pytest.mark.parametrize(
+        "container, guess_function, guess_range, rois",
+        [
+            (c, f[0], f[1], r)
+            for c in containers
+            for f in guess_functions
+            for r in [None, [[0, 2, 5], [1, 3, 4, 7]]]
+        ],
+    )
+    def test_second_order_cpa_engine(self, container, guess_function, guess_range, rois):
+        session = Session(container)
+        engine = SecondOrderCpaEngine(guess_function, guess_range, rois=rois, memory_budget=20000)
+        session.add_engine(engine)
+        session.run(batch_size=70)
+
+        container_bis = container[:]
+        number_of_samples = container_bis.leakages.shape[1]
+        if rois is None:
+            rois = [range(number_of_samples), range(number_of_samples)]
+        centered = container_bis.leakages - container_bis.leakages.mean(0)
+
+        cpa_np = np.zeros((len(guess_range), len(rois[0]), len(rois[1])))
+        for g, guess in enumerate(guess_range):
+            model = np.array([guess_function(d, guess) for d in container_bis.values])
+            for u, i in enumerate(rois[0]):
+                for v, j in enumerate(rois[1]):
+                    cpa_np[g, u, v] = np.corrcoef(model, centered[:, i] * centered[:, j])[0, 1]
+
+        assert np.all(
+            np.isclose(engine.finalize(), np.nan_to_num(cpa_np))
+        ), "second order cpa non_regression test not passed."
+
+
+class TestNonRegressionLra:
+    @pytest.mark.parametrize(
+        "container, regression_order",
+        [(c, o) for c in containers for o in [1, 2]],
+    )
+    def test_lra_engine(self, container, regression_order):
+        from lascar.engine.lra_engine import get_bit_coefficients
+
+        partition = lambda value: value[0] & 0xF
+        guess_function = lambda v, k: v ^ k
+        guess_range = range(16)
+
+        session = Session(container)
+        engine = LraEngine(
+            "lra", partition, range(16), guess_function, guess_range,
+            regression_order=regression_order, size_target_value=4,
+        )
+        session.add_engine(engine)
+        session.run(batch_size=70)
+
+        container_bis = container[:]
+        classes = np.apply_along_axis(partition, 1, container_bis.values)
+        leakages = container_bis.leakages
+        L = np.array([leakages[classes == v].mean(0) for v in range(16)])
+        SST = ((leakages - leakages.mean(0)) ** 2).sum(0)
+
+        lra_np = np.zeros((len(guess_range), leakages.shape[1]))
+        for k in guess_range:
+            M = np.array(
+                [get_bit_coefficients(guess_function(v, k), regression_order, 4) for v in range(16)],
+                dtype=np.double,
+            )
+            beta = np.linalg.lstsq(M, L, rcond=None)[0]
+            lra_np[k] = 1 - ((M @ beta - L) ** 2).sum(0) / SST
+
+        assert np.all(np.isclose(engine.finalize(), lra_np))
+
+    def test_lra_engine_rank_deficient(self):
+        # 4 partitions, but 1 + 4 + 6 coefficients to regress on
+        with pytest.raises(np.linalg.LinAlgError):
+            LraEngine(
+                "lra", lambda value: value[0] & 0x3, range(4), lambda v, k: v ^ k, range(16),
+                regression_order=2, size_target_value=4,
+            )
+
+    def test_lra_projection_cache(self):
+        from lascar.engine import lra_engine
+
+        for i in range(2 * lra_engine._projection_cache_size):
+            LraEngine(
+                "lra%d" % i, lambda value: value[0] & 0xF, range(16), lambda v, k: v ^ k, range(16),
+                size_target_value=4,
+            )
+        assert len(lra_engine._projection_cache) == lra_engine._projection_cache_size
+
+
+class TestNonRegressionMatch:
+    @pytest.mark.parametrize(
+        "container, batch_size, prediction_batch_size",
+        [(c, b, p) for c in containers for b, p in [(300, None), (70, 16)]],
+    )
+    def test_match_engine(self, container, batch_size, prediction_batch_size):
+        from sklearn.discriminant_analysis import LinearDiscriminantAnalysis
+
+        guess_function = lambda value, guess: (value[0] ^ guess) & 0x3
+        guess_range = range(8)
+
+        container_bis = container[:]
+        classifier = LinearDiscriminantAnalysis().fit(
+            container_bis.leakages, container_bis.values[:, 0] & 0x3
+        )
+
+        session = Session(container)
+        engine = MatchEngine(
+            classifier, guess_function, guess_range, prediction_batch_size=prediction_batch_size
+        )
+        session.add_engine(engine)
+        session.run(batch_size=batch_size)
+
+        log_probas = classifier.predict_log_proba(container_bis.leakages)
+        match_np = np.array(
+            [
+                sum(log_probas[i, guess_function(d, guess)] for i, d in enumerate(container_bis.values))
+                for guess in guess_range
+            ]
+        )
+
+        assert np.all(np.isclose(engine.finalize(), match_np))
+
+    @pytest.mark.parametrize("container", containers)
+    def test_profile_engine_streaming(self, container):
+        from sklearn.linear_model import SGDClassifier
+
+        partition = lambda value: value[0] & 0x3
+
+        session = Session(container)
+        engine = ProfileEngine(
+            SGDClassifier(random_state=0, shuffle=False), partition, range(4), streaming=True
+        )
+        session.add_engine(engine)
+        session.run(batch_size=70)
+
+        container_bis = container[:]
+        labels = container_bis.values[:, 0] & 0x3
+        classifier = SGDClassifier(random_state=0, shuffle=False)
+        for offset in range(0, len(labels), 70):
+            classifier.partial_fit(
+                container_bis.leakages[offset : offset + 70],
+                labels[offset : offset + 70],
+                classes=range(4),
+            )
+
+        assert np.all(engine._partition_count == np.bincount(labels, minlength=4))
+        assert np.all(np.isclose(engine.finalize().coef_, classifier.coef_))
+
+    def test_profile_engine_validation_mask(self):
+        from sklearn.linear_model import SGDClassifier
+
+        # the mask used by the streaming keras models: the same traces are held out at every epoch
+        engine = ProfileEngine(SGDClassifier(), lambda value: value[0] & 0x3, range(4), streaming=True, test_size=0.2)
+        mask = engine._get_validation_mask(1000).copy()
+        engine.history["loss"].append(1.0)
+        assert np.all(engine._get_validation_mask(1000) == mask)
+        assert engine.history["loss"] == [1.0]
+        assert 100 < mask.sum() < 300
+        assert len(engine._get_validation_mask(500)) == 500
+
+    def test_profile_engine_streaming_keras(self):
+        keras = pytest.importorskip("tensorflow").keras
+
+        container = BasicAesSimulationContainer(300, 1, value_section="plaintext", seed=1)
+        model = keras.Sequential(
+            [keras.Input((container.leakages.shape[1],)), keras.layers.Dense(4, activation="softmax")]
+        )
+        model.compile(optimizer="adam", loss="categorical_crossentropy")
+
+        engine = ProfileEngine(
+            model, lambda value: value[0] & 0x3, range(4), streaming=True, batch_size=32,
+            shuffle_buffer_size=1000, test_size=0.2, random_state=0,
+        )
+        Session(container, engine=engine, output_steps=[100, 200]).run(batch_size=50)
+
+        # the shuffle buffer is only flushed, and the validation loss computed, at the end of the epoch
+        n_train = (~engine._validation_mask).sum()
+        assert len(engine.history["loss"]) == -(-n_train // 32)
+        assert len(engine.history["val_loss"]) == 1
+        assert engine._buffer_count == 0
+
+
+class TestNonRegressionTemplate:
+    @pytest.mark.parametrize(
+        "container, pois", [(c, p) for c in containers for p in [None, [0, 3, 5, 6]]]
+    )
+    def test_template_engines(self, container, pois):
+        from scipy.stats import multivariate_normal
+
+        partition = lambda value: value[0] & 0x3
+        guess_function = lambda value, guess: (value[0] ^ guess) & 0x3
+        guess_range = range(8)
+
+        profile_engine = TemplateProfileEngine(partition, range(4), pois=pois)
+        Session(container, engine=profile_engine).run(batch_size=70)
+        templates = profile_engine.finalize()
+
+        container_bis = container[:]
+        x = container_bis.leakages if pois is None else container_bis.leakages[:, pois]
+        classes = container_bis.values[:, 0] & 0x3
+        means = np.array([x[classes == c].mean(0) for c in range(4)])
+        covariance = sum(
+            (x[classes == c] - means[c]).T @ (x[classes == c] - means[c]) for c in range(4)
+        ) / (len(x) - 4)
+
+        assert np.all(np.isclose(templates.means, means))
+        assert np.all(np.isclose(templates.covariance, covariance))
+
+        match_engine = TemplateMatchEngine(templates, guess_function, guess_range)
+        Session(container, engine=match_engine).run(batch_size=70)
+
+        log_likelihoods = np.array(
+            [multivariate_normal(means[c], covariance).logpdf(x) for c in range(4)]
+        ).T
+        match_np = np.array(
+            [
+                sum(log_likelihoods[i, guess_function(d, guess)] for i, d in enumerate(container_bis.values))
+                for guess in guess_range
+            ]
+        )
+        assert np.all(np.isclose(match_engine.finalize(), match_np))
+
+
+class TestNonRegressionMia:
+    @pytest.mark.parametrize(
+        "container, guess_function, guess_range",
+        [(c, f[0], f[1]) for c in containers for f in guess_functions],
+    )
+    def test_mia_engine(self, container, guess_function, guess_range):
+        container_bis = container[:]
+        bin_range = (container_bis.leakages.min(), container_bis.leakages.max())
+        n_bins = 4
+
+        session = Session(container)
+        engine = MiaEngine(guess_function, guess_range, 9, n_bins, bin_range, memory_budget=5000)
+        engine_rows = MiaEngine(guess_function, guess_range, 9, n_bins, bin_range, memory_budget=1, name="mia_rows")
+        session.add_engines([engine, engine_rows])
+        session.run(batch_size=70)
+
+        bin_width = (bin_range[1] - bin_range[0]) / n_bins
+        bins = np.clip(
+            ((container_bis.leakages - bin_range[0]) // bin_width).astype(int), 0, n_bins - 1
+        )
+
+        def entropy(x):
+            p = np.unique(x, return_counts=True, axis=0)[1] / len(x)
+            return -(p * np.log2(p)).sum()
+
+        mia_np = np.zeros((len(guess_range), bins.shape[1]))
+        for i, guess in enumerate(guess_range):
+            model = np.array([guess_function(d, guess) for d in container_bis.values])
+            for j in range(bins.shape[1]):
+                mia_np[i, j] = (
+                    entropy(model) + entropy(bins[:, j])
+                    - entropy(np.stack([model, bins[:, j]], 1))
+                )
+
+        assert np.all(np.isclose(engine.finalize(), mia_np))
+        assert np.all(engine_rows.finalize() == engine.finalize())
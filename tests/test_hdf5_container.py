@@ -2,6 +2,7 @@ import numpy as np
 import pytest
 import h5py
 from lascar.container import Hdf5Container, TraceBatchContainer
+from lascar.tools.processing import SpectrumProcessing
 
 import tempfile
 
@@ -46,3 +47,16 @@ class TestHdf5Container:
         for i, trace in enumerate(container_bis):
             assert np.all(trace.leakage == leakages[i])
             assert np.all(trace.value == values[i])
+
+    def test_leakage_mean_var_batch_processing(self, leakages, values):
+        filename = tempfile.mkdtemp() + "/tmp.h5"
+        container = Hdf5Container.export(TraceBatchContainer(leakages, values), filename)
+        container.leakages.attrs["mean"] = leakages.mean(0)
+        container.leakages.attrs["var"] = leakages.var(0)
+
+        # the stored mean/var are single leakages, not batches: they cannot be processed by process_batch()
+        container.leakage_processing = SpectrumProcessing()
+        mean, var = container.get_leakage_mean_var()
+        batch = container[:]
+        assert np.allclose(mean, batch.leakages.mean(0))
+        assert np.allclose(var, batch.leakages.var(0))
@@ -129,3 +129,36 @@ def test_standard_scaler(container):
 #         assert np.all(np.isclose(processing(trace.leakage), processing_bis(trace.leakage)))
 #
 #
+
+
+spectrum_parameters = [
+    (None, None, None, "magnitude", True),
+    ("hanning", None, None, "power", True),
+    ("hamming", 32, None, "magnitude", True),
+    (None, 20, 10, "power", False),
+]
+
+
+@pytest.mark.parametrize(
+    "container, window, segment_length, segment_step, output, average_segments",
+    [(container,) + p for p in spectrum_parameters],
+)
+def test_spectrum(container, window, segment_length, segment_step, output, average_segments):
+    spectrum_processing = SpectrumProcessing(window, segment_length, segment_step, output, average_segments)
+    container.leakage_processing = spectrum_processing
+
+    length = 100 if segment_length is None else segment_length
+    step = length if segment_step is None else segment_step
+    w = np.ones(length) if window is None else getattr(np, window)(length)
+
+    batch = container[:]
+    for i in range(len(leakages)):
+        segments = [leakages[i, j : j + length] for j in range(0, 100 - length + 1, step)]
+        spectra = np.array([np.abs(np.fft.rfft(s * w)) for s in segments])
+        if output == "power":
+            spectra = spectra ** 2
+        if average_segments:
+            spectra = spectra.mean(0)
+        assert np.allclose(batch.leakages[i], spectra)
+        assert np.allclose(spectrum_processing(leakages[i]), spectra)
+    container.leakage_processing = None